@@ -0,0 +1,199 @@
+# api/upload.py
+# Resumable uploads: the file is sent in chunks (PUT with the byte offset of the chunk)
+# that are streamed to disk and hashed as they arrive, so neither the frontend nor the
+# backend holds the whole capture in memory and an interrupted upload continues from
+# the last byte received. A file whose sha256 matches an earlier upload reuses that
+# upload's cleaned dataset (backendInterface.DATASET_STORE) instead of parsing it again.
+import os, re, json, uuid, hashlib, asyncio, tempfile
+from fastapi import APIRouter, HTTPException, Request
+from starlette.concurrency import run_in_threadpool
+from pydantic import BaseModel
+from backend.backendInterface import add_data, use_data, backend_data, DATASET_STORE
+from backend.dataIngest import file_format
+
+# where the chunks of unfinished uploads are kept
+UPLOAD_DIR = os.getenv("ADAS_UPLOAD_DIR", os.path.join(tempfile.gettempdir(), "adas_uploads"))
+# chunk size suggested to clients, and the largest chunk accepted
+UPLOAD_CHUNK_BYTES = int(os.getenv("ADAS_UPLOAD_CHUNK_MB", "8")) * 2**20
+MAX_CHUNK_BYTES = 8 * UPLOAD_CHUNK_BYTES
+# bytes read at a time when hashing a partial upload again after a restart
+HASH_BLOCK_BYTES = 2**20
+
+router = APIRouter(prefix="/api/upload", tags=["upload"])
+
+class UploadInit(BaseModel):
+    filename: str
+    size: int
+    sha256: str | None = None # lets the client skip the upload of a file the backend already has
+    upload_id: str | None = None # an unfinished upload of this client to resume
+    uidHeader: str | None = None
+    tsHeader: str | None = None
+    sceIPHeader: str | None = None
+
+# upload_id -> session (its metadata is also in UPLOAD_DIR/<upload_id>.json)
+sessions = {}
+
+
+def _meta_path(upload_id):
+    return os.path.join(UPLOAD_DIR, upload_id + ".json")
+
+def _save_meta(session):
+    with open(_meta_path(session["upload_id"]), "w") as f:
+        json.dump({k: session[k] for k in ("upload_id", "filename", "size", "sha256", "path", "headers")}, f)
+
+def _new_session(init):
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    upload_id = uuid.uuid4().hex
+    # keep the name (and so the format) of the file, without anything path-like
+    safe_name = re.sub(r"[^A-Za-z0-9._-]", "_", os.path.basename(init.filename))
+    meta = {"upload_id": upload_id, "filename": init.filename, "size": init.size, "sha256": init.sha256,
+            "path": os.path.join(UPLOAD_DIR, f"{upload_id}_{safe_name}"),
+            "headers": {"uid": init.uidHeader, "time": init.tsHeader, "source_ip": init.sceIPHeader}}
+    open(meta["path"], "wb").close()
+    sessions[upload_id] = session = {**meta, "received": 0, "hash": hashlib.sha256(), "lock": asyncio.Lock()}
+    _save_meta(session)
+    return session
+
+def _session(upload_id):
+    """Returns the session of upload_id, loading it from disk (after a restart) if needed."""
+    session = sessions.get(upload_id)
+    if session is not None:
+        return session
+    if not re.fullmatch(r"[0-9a-f]{32}", upload_id) or not os.path.exists(_meta_path(upload_id)):
+        raise HTTPException(status_code=404, detail="Unknown upload")
+    with open(_meta_path(upload_id)) as f:
+        meta = json.load(f)
+    # the hash of the bytes received so far is computed again from the partial file
+    digest = hashlib.sha256()
+    with open(meta["path"], "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_BYTES), b""):
+            digest.update(block)
+    sessions[upload_id] = session = {**meta, "received": os.path.getsize(meta["path"]), "hash": digest,
+                                     "lock": asyncio.Lock()}
+    return session
+
+def _resumable(init):
+    """
+    Returns the unfinished upload init.upload_id (e.g. from before a page reload) if it
+    is an upload of the same file: same name, size and sha256. Otherwise (or if the
+    client holds no upload_id) returns None and a new upload is started.
+    """
+    if init.upload_id is None or init.sha256 is None:
+        return None
+    try:
+        session = _session(init.upload_id)
+    except HTTPException:
+        return None
+    if session["filename"] != init.filename or session["size"] != init.size or session["sha256"] != init.sha256:
+        return None
+    return session
+
+def _remove(session):
+    sessions.pop(session["upload_id"], None)
+    for path in (session["path"], _meta_path(session["upload_id"])):
+        if os.path.exists(path):
+            os.remove(path)
+
+def _status(session):
+    return {"upload_id": session["upload_id"], "filename": session["filename"], "size": session["size"],
+            "received": session["received"], "chunk_size": UPLOAD_CHUNK_BYTES}
+
+async def _load(file, digest, headers):
+    """
+    Loads the dataset stored for digest or, if there is none (or it cannot be read), the
+    one in file, and sets the column headers, like /add_data/. Returns None if neither is
+    available (file is None).
+    """
+    # looked up once: the store may evict or fail to read a dataset between two calls
+    stored = await run_in_threadpool(DATASET_STORE.get, digest)
+    if stored is not None:
+        cleaned_df = await run_in_threadpool(use_data, *stored) # with the catalog profiled at the first upload
+    elif file is not None:
+        cleaned_df = await run_in_threadpool(add_data, file, digest)
+    else:
+        return None
+    backend_data["uid"] = headers["uid"]
+    backend_data["time"] = headers["time"]
+    backend_data["source_ip"] = headers["source_ip"]
+    return {"status": "success", "rows": cleaned_df.shape[0], "columns": cleaned_df.shape[1],
+            "sha256": digest, "reused": stored is not None}
+
+
+@router.post("/init", response_model=dict)
+async def init_upload(init: UploadInit):
+    """
+    Starts (or resumes) an upload. Returns the upload_id and the number of bytes
+    already received; if the client sends the sha256 of a file the backend already
+    has, the dataset is loaded right away and nothing needs to be uploaded. An upload
+    is resumed only for the upload_id (and sha256) the client sent when it started it,
+    so bytes of different files are never put together.
+    """
+    try:
+        file_format(init.filename)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if init.size < 0:
+        raise HTTPException(status_code=400, detail="Invalid file size")
+    if init.sha256 is not None:
+        if not re.fullmatch(r"[0-9a-fA-F]{64}", init.sha256):
+            raise HTTPException(status_code=400, detail="Invalid sha256")
+        init.sha256 = init.sha256.lower()
+    headers = {"uid": init.uidHeader, "time": init.tsHeader, "source_ip": init.sceIPHeader}
+    if init.sha256 is not None:
+        loaded = await _load(None, init.sha256, headers)
+        if loaded is not None:
+            return {"done": True, **loaded}
+    session = _resumable(init) or _new_session(init)
+    session["headers"] = headers
+    _save_meta(session)
+    return {"done": False, **_status(session)}
+
+@router.get("/{upload_id}", response_model=dict)
+async def upload_status(upload_id: str):
+    """Returns the size of the upload and the number of bytes received, where the client resumes."""
+    return _status(_session(upload_id))
+
+@router.put("/{upload_id}", response_model=dict)
+async def upload_chunk(upload_id: str, offset: int, request: Request):
+    """Appends the request body (the bytes of the file from offset on) to the upload."""
+    session = _session(upload_id)
+    async with session["lock"]:
+        if offset != session["received"]:
+            raise HTTPException(status_code=409, detail=f"Expected offset {session['received']}")
+        written = 0
+        # the bytes of an interrupted chunk are kept, the client resumes after them
+        with open(session["path"], "ab") as f:
+            async for data in request.stream():
+                written += len(data)
+                if written > MAX_CHUNK_BYTES or session["received"] + len(data) > session["size"]:
+                    raise HTTPException(status_code=413, detail="Chunk too large")
+                f.write(data)
+                session["hash"].update(data)
+                session["received"] += len(data)
+    return _status(session)
+
+@router.post("/{upload_id}/complete", response_model=dict)
+async def complete_upload(upload_id: str):
+    """Checks the hash of the finished upload and loads it (or the stored dataset with that hash)."""
+    session = _session(upload_id)
+    async with session["lock"]:
+        if session["received"] != session["size"]:
+            raise HTTPException(status_code=409, detail=f"Upload incomplete: {session['received']} of {session['size']} bytes")
+        digest = session["hash"].hexdigest()
+        if session["sha256"] is not None and session["sha256"] != digest:
+            _remove(session)
+            raise HTTPException(status_code=400, detail="sha256 of the upload does not match")
+        try:
+            result = await _load(session["path"], digest, session["headers"])
+        except Exception as e:
+            print("[/api/upload] ERROR:", repr(e), flush=True)
+            raise HTTPException(status_code=400, detail="Error reading file. Please try again")
+        finally:
+            _remove(session)
+    return {"done": True, **result}
+
+@router.delete("/{upload_id}", response_model=dict)
+async def abort_upload(upload_id: str):
+    """Discards an unfinished upload."""
+    _remove(_session(upload_id))
+    return {"status": "aborted"}
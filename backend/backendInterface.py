@@ -4,13 +4,17 @@
 # Imports
 import pandas as pd
 import numpy as np
-import requests, json, ipaddress
+import os, requests, json, ipaddress
 from sklearn.decomposition import PCA
-from sklearn.preprocessing import StandardScaler, LabelEncoder
+from sklearn.preprocessing import StandardScaler
 from datetime import datetime, timedelta
 from dateutil.parser import parse
 from fastapi import HTTPException
-from backend.reinforcementLearning import run_rl
+from backend.reinforcementLearning import run_rl, query_options
+from backend.dataIngest import read_table
+from backend.datasetStore import DatasetStore
+from backend.columnCatalog import build_catalog, column_profile, needs_cleaning
+from backend.categoryEncoding import CategoryDictionaries
 # from backend.featureMapping import explain_features
 
 
@@ -22,9 +26,18 @@ backend_data = {"df": pd.DataFrame,
                 "int_source_ip": None,
                 "features": None,
                 "final_features": None,
-                "anomalies": None
+                "anomalies": None,
+                "run_info": None,
+                "catalog": None # per-column statistics of df, see columnCatalog
                 } #the backend "memory"
 
+# cleaned datasets of earlier uploads by content hash, so re-uploads skip the parsing.
+# ADAS_DATASET_DIR enables the on-disk store.
+DATASET_STORE = DatasetStore(max_bytes=int(os.getenv("ADAS_DATASET_CACHE_MB", "512")) * 2**20,
+                             disk_dir=os.getenv("ADAS_DATASET_DIR"))
+# labels of the encoded qualitative columns per schema, so uploads with the same columns share codes
+CATEGORY_DICTIONARIES = CategoryDictionaries()
+
 ##### DATA PREPARATION #####
 def ip_to_int(ip):
     if ":" not in ip:   # IPv4
@@ -35,18 +48,31 @@ def ip_to_int(ip):
 
 '''
 Summary: Takes in user-uploaded data, cleans it, and sets the global dataframe.
-Input: file (CSV file)
+Input: file (CSV file), digest (optional sha256 of the file; the cleaned dataset is stored under it
+       so later uploads of the same file can reuse it, see api/upload.py)
 Output: cleaned_df (Pandas DataFrame)
 '''
-def add_data(file):
+def add_data(file, digest=None):
     # print(type(file))
     # if not hasattr(file, "filename") or not file.filename.lower().endswith(".csv"):
     #     raise ValueError("Only CSV files are allowed")
     
-    raw_file = pd.read_csv(file.file if hasattr(file, "file") else file)
-    cleaned_df = clean_data(raw_file)
-    backend_data["df"] = cleaned_df
+    # read in chunks, cleaned like clean_data and with compact column types (see dataIngest)
+    cleaned_df = read_table(file.file if hasattr(file, "file") else file, name=getattr(file, "filename", None))
+    catalog = build_catalog(cleaned_df)
+    if digest is not None:
+        DATASET_STORE.put(digest, cleaned_df, catalog)
     # print("At add data", cleaned_df.columns)
+    return use_data(cleaned_df, catalog)
+
+'''
+Summary: Sets an already cleaned dataset (e.g. one of DATASET_STORE) as the global dataframe.
+Input: cleaned_df (Pandas DataFrame), catalog (its column catalog; profiled again if None)
+Output: cleaned_df
+'''
+def use_data(cleaned_df, catalog=None):
+    backend_data["df"] = cleaned_df
+    backend_data["catalog"] = build_catalog(cleaned_df) if catalog is None else catalog
     return cleaned_df
 
 def clean_data(df):
@@ -81,6 +107,8 @@ Output:
 def find_anomalies(query, uid, num_feat, time, source_ip):
     ## VAR SETUP
     df = backend_data["df"]
+    # per-query search settings (budgets, strategy, seed, ...), checked before any work is done
+    rl_options = query_options(query or {})
     # print("in find anomalies:", df.columns)
     # print("Data shape:", df.shape)    
     # print("num_feat:", num_feat)
@@ -91,9 +119,10 @@ def find_anomalies(query, uid, num_feat, time, source_ip):
     # raise HTTPException(status_code=501, detail="Function not yet implemented.")
 
 
+    schema = tuple(df.columns)
     if uid is None: 
         uid = "uid"
-        df[uid] = df.index
+        df = df.assign(**{uid: df.index}) # not in place, the uploaded frame stays as it is
     backend_data["uid"] = uid
     # TODO: if no time filtering is specified, time can remain None. only if the query contains time filtering, should we check
     backend_data["time"] = time
@@ -113,14 +142,20 @@ def find_anomalies(query, uid, num_feat, time, source_ip):
     ## FEATURE SELECTION
     num_entries = df.shape[0]
     drop = []
+    if backend_data["catalog"] is None:
+        backend_data["catalog"] = {}
+    catalog = backend_data["catalog"] # profiled at upload, so reruns don't rescan the columns
+    encode = []
     for i in df:
-        if df[i].dtype == 'O' and i not in main_identifiers: # qualitative
-            qual_to_quant(df, i)
-            if df[i].nunique() > (num_entries / 2) or df[i].nunique() == 1: # if more than 1/2 of data points have a unique label OR all have same label, drop the column. can change this!
+        profile = column_profile(catalog, df, i)
+        if profile["qualitative"] and i not in main_identifiers: # qualitative (encoding keeps the number of labels)
+            if profile["distinct"] > (num_entries / 2) or profile["distinct"] == 1: # if more than 1/2 of data points have a unique label OR all have same label, drop the column. can change this!
                 drop.append(i)
+            elif not pd.api.types.is_numeric_dtype(df[i]): # not encoded by an earlier run yet
+                encode.append(i)
     # print(drop)
     # print("before drop:", df.columns)
-    cleaned_df = df.drop(columns = drop)
+    cleaned_df = df.drop(columns = drop).assign(**CATEGORY_DICTIONARIES.encode(df, encode, schema))
     #qual_to_quant(cleaned_df, uid)
     backend_data["df"] = cleaned_df
     # print("after drop:", cleaned_df.columns)
@@ -150,17 +185,13 @@ def find_anomalies(query, uid, num_feat, time, source_ip):
 
     #raise Exception("got features. paused.")
     ## REINFORCEMENT LEARNING
-    anomalies, cluster_sizes, final_features = run_rl(backend_data) #TODO: others for output data
+    anomalies, cluster_sizes, final_features, run_info = run_rl(backend_data, rl_options) #TODO: others for output data
     backend_data["anomalies"] = anomalies
+    backend_data["run_info"] = run_info # e.g. reward cache hit/miss counters
     backend_data["final_features"] = final_features
     # print("Final Features", final_features)
     return anomalies
 
-'''Converts the qualitative column col in df to quantitative values'''
-def qual_to_quant(df, col):
-    le = LabelEncoder()
-    df[col] = le.fit_transform(df[col])
-
 "Returns an array with the indexes of the top n values in arr"
 def get_top_n_idx(n, arr):
   arr = np.abs(arr)
@@ -185,7 +216,7 @@ def get_features(data, top_n, main_identifiers):
 
   
   feat_options["epoch_time"] = feat_options["epoch_time"].astype(int) // 10**9
-  feat_options["int_source_ip"] = copy[backend_data['source_ip']].apply(
+  feat_options["int_source_ip"] = copy[backend_data['source_ip']].astype(object).apply( # plain values, the column may be categorical
       lambda ip: int(ip.replace('.', ''), 16) if '.' in ip else int(ip.replace(':', ''), 16)
   )
 
@@ -207,20 +238,14 @@ def get_features(data, top_n, main_identifiers):
 #   print(feat_options["int_source_ip"].dtype)
 #   print(feat_options["int_source_ip"])
 
-  feat_options = feat_options.replace([np.inf, -np.inf], np.nan)
-  feat_options = feat_options.fillna(0)  # or use median filling
-
+  # only the columns the catalog saw missing or infinite values in need cleaning (epoch_time
+  # and int_source_ip were just computed)
+  catalog = backend_data["catalog"] if backend_data["catalog"] is not None else {}
   for col in feat_options.columns:
-    col_data = feat_options[col]
-
-    if col_data.isna().any():
-        print(f"❗ NaNs in {col}")
-
-    if np.isinf(col_data).any():
-        print(f"❗ Inf detected in: {col}")
-
-    if (col_data.abs() > np.finfo(np.float64).max).any():
-        print(f"❗ Overflow! Too large for float64 in: {col}")
+    if col not in ("epoch_time", "int_source_ip") and needs_cleaning(catalog, data, col):
+        profile = catalog[col]
+        print(f"❗ {profile['nulls']} NaNs and {profile['infinite']} Inf in {col}, set to 0")
+        feat_options[col] = feat_options[col].replace([np.inf, -np.inf], np.nan).fillna(0)  # or use median filling
 
     # print("Max per column:")
     # print(feat_options.max())
@@ -306,7 +331,7 @@ def get_output(query):
     # convert start, end, and time column to DT naive
     start = parse(start).replace(tzinfo=None)
     end = parse(end).replace(tzinfo=None)
-    targeted_df['datetime-parsed'] = targeted_df[backend_data['time']].apply(lambda x: parse(x).replace(tzinfo=None))
+    targeted_df['datetime-parsed'] = targeted_df[backend_data['time']].apply(lambda x: (x if isinstance(x, datetime) else parse(x)).replace(tzinfo=None))
     timefilter_df = targeted_df[
         (targeted_df['datetime-parsed'] >= start) &
         (targeted_df['datetime-parsed'] <= end)
@@ -365,8 +390,13 @@ def get_output(query):
     'cols': filtered_output_data.columns.tolist(),
     'rows': filtered_output_data.values.tolist()
     }
+    # whether the feature/algorithm search converged or stopped on its time/evaluation budget
+    run_info = backend_data["run_info"] or {}
+    search = {"converged": run_info.get("converged"), "stop_reason": run_info.get("stop_reason"), "algorithm": run_info.get("algorithm"),
+              "algorithm_costs": run_info.get("algorithm_costs")}
+
     # structure anomaly output data
-    return {'explain':explain, 'vt_lookups': lookups, 'anomalies': output_dict, 'csv': csv}
+    return {'explain':explain, 'vt_lookups': lookups, 'anomalies': output_dict, 'csv': csv, 'search': search}
 
 # def hash_ip(ip: str) -> int:
 #     h = hashlib.blake2b(ip.encode(), digest_size=8)  # 8 bytes = 64-bit
@@ -0,0 +1,84 @@
+# Encoding of the qualitative (text and categorical) columns of a dataset as integer
+# codes for find_anomalies. A column is encoded in one vectorized pass (pandas' hash
+# factorizer, or the codes of a categorical column) into the smallest integer type,
+# with the codes of LabelEncoder (the rank of the value among the sorted labels). The
+# labels of every column are kept per schema (column names), so a later upload with
+# the same columns keeps the codes of the values seen before.
+
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from backend.rewardCache import compact_labels
+
+
+'''
+Returns (codes, categories): the integer codes of the values of col (smallest integer
+type) and the labels they index. Without categories, the labels are the sorted values
+of col (the codes of sklearn's LabelEncoder). With the categories of an earlier
+encoding, their values keep their codes and new values are appended in sorted order.
+Missing values get the code -1.
+'''
+def encode_column(col, categories=None):
+    if isinstance(col.dtype, pd.CategoricalDtype):
+        codes = col.cat.codes.to_numpy()
+        uniques = col.cat.categories
+        # only the categories that occur, as LabelEncoder sees them
+        used = np.flatnonzero(np.bincount(codes[codes >= 0], minlength=len(uniques)))
+        lookup = np.full(len(uniques), -1, dtype=np.int64)
+        lookup[used] = np.arange(len(used))
+        codes, uniques = np.where(codes >= 0, lookup[codes], -1), uniques[used]
+    else:
+        codes, uniques = pd.factorize(col.to_numpy())
+        uniques = pd.Index(uniques)
+    if categories is None:
+        categories = uniques.sort_values()
+    else:
+        new = uniques.difference(categories) # sorted
+        if len(new):
+            categories = categories.append(new)
+    # position of every value of uniques among the categories, then of every row (missing values stay -1)
+    positions = categories.get_indexer(uniques)
+    return compact_labels(np.where(codes >= 0, positions[codes] if len(positions) else -1, -1)), categories
+
+
+class CategoryDictionaries:
+    """
+    LRU store of the labels of the encoded columns, per schema. Safe to share
+    between threads.
+
+    Parameters:
+        max_schemas: int, number of schemas whose labels are kept
+    """
+
+    def __init__(self, max_schemas=16):
+        self.max_schemas = max_schemas
+        self.schemas = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, schema):
+        """Returns the dict of column -> labels kept for schema (empty for a new schema)."""
+        with self.lock:
+            if schema in self.schemas:
+                self.schemas.move_to_end(schema)
+                return dict(self.schemas[schema])
+            return {}
+
+    def put(self, schema, dictionaries):
+        with self.lock:
+            self.schemas[schema] = dict(dictionaries)
+            self.schemas.move_to_end(schema)
+            while len(self.schemas) > self.max_schemas:
+                self.schemas.popitem(last=False)
+
+    def encode(self, df, columns, schema):
+        """
+        Returns a dict of column -> codes of the given columns of df, encoded with
+        (and adding to) the labels kept for schema. df is not modified.
+        """
+        dictionaries = self.get(schema)
+        encoded = {}
+        for name in columns:
+            encoded[name], dictionaries[name] = encode_column(df[name], dictionaries.get(name))
+        self.put(schema, dictionaries)
+        return encoded
@@ -0,0 +1,103 @@
+# CLARA (Clustering LARge Applications) k-medoids for captures too large for
+# sklearn_extra's KMedoids, which needs the full n x n distance matrix.
+# KMedoids runs on several random samples of the rows; the medoids of each sample
+# are scored on all rows and the best set is kept. The rows are assigned to their
+# closest medoid in chunks, so memory stays O(chunk_rows * k).
+# RowInitKMedoids starts KMedoids from given rows (e.g. warm medoids, see
+# reinforcementLearning.warm_medoids).
+
+import os
+import numpy as np
+from sklearn.metrics.pairwise import euclidean_distances
+from sklearn_extra.cluster import KMedoids
+
+
+class RowInitKMedoids(KMedoids):
+    """
+    KMedoids that starts from the rows medoid_rows (one index per medoid in the X it is
+    fit on) when they are set, and from its init otherwise. An array init of
+    sklearn_extra is looked up by value among the rows of X, which fails for points that
+    are not rows of X and starts one medoid per copy of a duplicated row.
+    """
+
+    medoid_rows = None
+
+    def _initialize_medoids(self, D, n_clusters, random_state_, X=None):
+        if self.medoid_rows is None:
+            return super()._initialize_medoids(D, n_clusters, random_state_, X)
+        return np.array(self.medoid_rows, dtype=np.int64) # updated in place by the fit
+
+'''
+Returns a RowInitKMedoids (not fit yet) that starts from the rows medoid_rows, or from
+k-medoids++ if they are not n_clusters distinct rows.
+'''
+def kmedoids_from_rows(n_clusters, medoid_rows=None, **params):
+    model = RowInitKMedoids(n_clusters=n_clusters, method="alternate", init="k-medoids++", **params)
+    if medoid_rows is not None and len(np.unique(medoid_rows)) == n_clusters:
+        model.medoid_rows = medoid_rows
+    return model
+
+'''Returns the bytes of memory available to this process, or None if unknown.'''
+def available_memory():
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, AttributeError, OSError): # not available on this platform
+        return None
+
+'''Returns the bytes needed at most by KMedoids on n_rows rows (its float64 distance matrix and a working copy).'''
+def full_kmedoids_memory(n_rows):
+    return 2 * n_rows * n_rows * 8
+
+'''
+Returns True if k-medoids on n_rows rows should use CLARA: above max_rows rows, or
+when the full KMedoids would need more than half of the available memory.
+'''
+def clara_needed(n_rows, max_rows):
+    available = available_memory()
+    return n_rows > max_rows or (available is not None and full_kmedoids_memory(n_rows) > available / 2)
+
+'''
+Returns the index of the closest medoid of every row of X and the sum of the distances
+to them, computing chunk_rows rows of distances at a time.
+'''
+def assign_to_medoids(X, medoids, chunk_rows=8192):
+    labels = np.empty(len(X), dtype=np.intp)
+    cost = 0.0
+    for start in range(0, len(X), chunk_rows):
+        distances = euclidean_distances(X[start:start + chunk_rows], medoids)
+        labels[start:start + chunk_rows] = distances.argmin(axis=1)
+        cost += float(distances.min(axis=1).sum())
+    return labels, cost
+
+'''
+Runs CLARA k-medoids on X and returns the labels and the row indexes of the medoids.
+
+Parameters:
+    X: array, shape (n_samples, n_features)
+    n_clusters: int, number of medoids
+    n_draws: int, number of samples KMedoids runs on
+    sample_size: int, rows per sample (at least 40 + 2 * n_clusters, as in CLARA)
+    init: optional array of the row indexes of n_clusters starting medoids, put in the
+        first sample (which starts from them) like the best medoids in later ones
+    chunk_rows: int, rows assigned at a time
+    rng: numpy Generator of the samples and of the KMedoids seeds (a new unseeded one by default)
+'''
+def clara_kmedoids(X, n_clusters, n_draws=5, sample_size=1000, init=None, chunk_rows=8192, rng=None, max_iter=300):
+    rng = np.random.default_rng() if rng is None else rng
+    n = len(X)
+    sample_size = min(n, max(sample_size, 40 + 2 * n_clusters))
+    best_cost, best_medoids, best_labels = np.inf, None, None
+    for draw in range(n_draws):
+        sample = rng.choice(n, size=sample_size, replace=False)
+        # every sample also holds the best medoids so far (the starting medoids in the first one)
+        kept = init if draw == 0 else best_medoids
+        if kept is not None:
+            sample = np.union1d(sample[:sample_size - n_clusters], kept)
+        start = np.searchsorted(sample, init) if draw == 0 and init is not None else None
+        model = kmedoids_from_rows(n_clusters, start, max_iter=max_iter,
+                                   random_state=int(rng.integers(2**31))).fit(X[sample])
+        medoids = sample[model.medoid_indices_]
+        labels, cost = assign_to_medoids(X, X[medoids], chunk_rows)
+        if cost < best_cost:
+            best_cost, best_medoids, best_labels = cost, medoids, labels
+    return best_labels, best_medoids
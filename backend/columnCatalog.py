@@ -0,0 +1,80 @@
+# Per-column statistics of the uploaded dataset (dtype, cardinality, missing and
+# infinite values, min/max), computed once by add_data and kept in
+# backend_data["catalog"] so that feature selection and reruns look them up instead of
+# scanning the columns again. Distinct counts of columns with more than
+# EXACT_DISTINCT_ROWS rows are estimated with a KMV (k minimum values) sketch.
+
+import os
+import numpy as np
+import pandas as pd
+
+# columns with at most this many rows get exact distinct counts
+EXACT_DISTINCT_ROWS = int(os.getenv("ADAS_CATALOG_EXACT_ROWS", "1000000"))
+# hashes kept by the KMV sketch (relative error about 1/sqrt(k), ~3%)
+KMV_K = 1024
+
+
+'''
+Returns (distinct, exact): the number of distinct values among the 64-bit hashes,
+estimated from the k-th smallest distinct hash (KMV sketch). When the column has fewer
+than k distinct values the count found is exact.
+'''
+def kmv_distinct(hashes, k=KMV_K):
+    n = len(hashes)
+    m = 4 * k
+    while True:
+        smallest = np.unique(hashes) if m >= n else np.unique(np.partition(hashes, m - 1)[:m])
+        if len(smallest) >= k:
+            # the k smallest of d uniform hashes lie below about k / d of the hash range
+            return int(round((k - 1) * 2.0**64 / (float(smallest[k - 1]) + 1))), False
+        if m >= n:
+            return len(smallest), True
+        m *= 8
+
+'''Returns the profile (dict) of the pandas Series col.'''
+def profile_column(col, exact_rows=EXACT_DISTINCT_ROWS):
+    values = col.to_numpy()
+    qualitative = col.dtype == object or isinstance(col.dtype, pd.CategoricalDtype)
+    profile = {"dtype": str(col.dtype), "qualitative": bool(qualitative), "rows": len(col),
+               "nulls": int(col.isna().sum()), "infinite": 0, "min": None, "max": None}
+    if isinstance(col.dtype, pd.CategoricalDtype):
+        codes = col.cat.codes.to_numpy()
+        # categories that occur (the codes are small integers, so this is exact and cheap)
+        profile["distinct"] = int(np.count_nonzero(np.bincount(codes[codes >= 0], minlength=1)))
+        profile["distinct_exact"] = True
+    elif len(col) <= exact_rows:
+        profile["distinct"] = int(col.nunique())
+        profile["distinct_exact"] = True
+    else:
+        # repeated strings are categoricals after ingestion, so the text columns left are
+        # mostly unique and hashing them without factorizing first is faster
+        hashes = pd.util.hash_array(col.dropna().to_numpy(), categorize=False)
+        profile["distinct"], profile["distinct_exact"] = kmv_distinct(hashes) if len(hashes) else (0, True)
+    if pd.api.types.is_float_dtype(col):
+        profile["infinite"] = int(np.isinf(values).sum())
+    if len(col) > profile["nulls"] and (pd.api.types.is_numeric_dtype(col) and not pd.api.types.is_bool_dtype(col)
+                                        or pd.api.types.is_datetime64_any_dtype(col)):
+        finite = col[~np.isinf(values)] if profile["infinite"] else col
+        profile["min"], profile["max"] = finite.min(), finite.max()
+        if isinstance(profile["min"], np.generic):
+            profile["min"], profile["max"] = profile["min"].item(), profile["max"].item()
+    return profile
+
+'''Returns the catalog (dict of column name -> profile) of df.'''
+def build_catalog(df, exact_rows=EXACT_DISTINCT_ROWS):
+    return {name: profile_column(col, exact_rows) for name, col in df.items()}
+
+'''
+Returns the profile of column name of df from catalog, profiling the column (and
+adding it to catalog) if it is not there yet, e.g. a column added after the upload.
+'''
+def column_profile(catalog, df, name):
+    profile = catalog.get(name)
+    if profile is None:
+        profile = catalog[name] = profile_column(df[name])
+    return profile
+
+'''Returns True if the column name of df may hold missing or infinite values.'''
+def needs_cleaning(catalog, df, name):
+    profile = column_profile(catalog, df, name)
+    return profile["nulls"] > 0 or profile["infinite"] > 0
@@ -0,0 +1,174 @@
+# Streaming ingestion of the uploads of add_data (CSV and Parquet).
+# The file is read in chunks (pyarrow's streaming readers, or pandas' chunked CSV
+# reader without pyarrow). Every chunk is cleaned (rows with missing values dropped)
+# and compacted (smallest integer types, lossless float32, categoricals for repeated
+# strings) before the next one is read, so memory holds a few raw chunks plus the
+# compacted result instead of the whole file as Python strings.
+
+import os
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    import pyarrow.parquet as pa_parquet
+except ImportError: # CSV uploads fall back to pandas, Parquet uploads are refused
+    pa = None
+from backend.zeekReader import ZEEK_FORMATS, zeek_chunks
+
+# bytes of CSV parsed per chunk, and rows per Parquet batch
+CHUNK_BYTES = int(os.getenv("ADAS_INGEST_CHUNK_MB", "16")) * 2**20
+PARQUET_BATCH_ROWS = 65536
+# string columns with at most this fraction of distinct values (per chunk) become categoricals
+CATEGORY_RATIO = 0.5
+SUPPORTED_FORMATS = (".csv", ".parquet") + ZEEK_FORMATS
+
+
+'''Returns the file format (e.g. ".csv" or ".parquet") of the upload, from its name.'''
+def file_format(name):
+    root, ext = os.path.splitext(str(name).lower())
+    if ext == ".gz" and os.path.splitext(root)[1] in ZEEK_FORMATS: # rotated Zeek logs are gzipped
+        ext = os.path.splitext(root)[1]
+    if ext == ".pq":
+        ext = ".parquet"
+    if ext not in SUPPORTED_FORMATS:
+        raise ValueError(f"Unsupported file type {ext or name!r}, expected one of {SUPPORTED_FORMATS}")
+    return ext
+
+'''
+Returns a copy of df with compact column types: integers in the smallest type that
+holds them, floats in float32 when no value changes, and object (string) columns with
+at most category_ratio distinct values as categoricals.
+'''
+def compact_dtypes(df, category_ratio=CATEGORY_RATIO):
+    columns = {}
+    for name, col in df.items():
+        if pd.api.types.is_bool_dtype(col) or isinstance(col.dtype, pd.CategoricalDtype):
+            pass
+        elif pd.api.types.is_integer_dtype(col):
+            col = pd.to_numeric(col, downcast="integer")
+        elif pd.api.types.is_float_dtype(col):
+            small = col.astype(np.float32)
+            if np.array_equal(small.to_numpy(np.float64), col.to_numpy(np.float64), equal_nan=True):
+                col = small
+        elif col.dtype == object and len(col) and col.nunique() <= category_ratio * len(col):
+            col = col.astype("category")
+        columns[name] = col
+    return pd.DataFrame(columns, index=df.index)
+
+'''
+Cleans one chunk like backendInterface.clean_data: blanks are missing values and rows
+with a missing value are dropped. Columns that are entirely missing in the chunk are
+not held against its rows yet (they may be dropped for the whole file). Returns the
+kept rows and the set of those entirely missing columns.
+'''
+def clean_chunk(chunk):
+    chunk = chunk.replace("", np.nan)
+    missing = chunk.isna()
+    empty = set(chunk.columns[missing.all(axis=0).to_numpy()]) if len(chunk) else set()
+    keep = ~missing.drop(columns=list(empty)).any(axis=1)
+    return chunk[keep.to_numpy()], empty
+
+'''
+Concatenates the compacted chunks; a column that is categorical in every chunk stays
+categorical (with the union of the categories).
+'''
+def combine_chunks(chunks):
+    if not chunks:
+        return pd.DataFrame()
+    if len(chunks) == 1:
+        return chunks[0]
+    categorical = [name for name in chunks[0].columns
+                   if all(isinstance(chunk[name].dtype, pd.CategoricalDtype) for chunk in chunks)]
+    if categorical:
+        # every chunk gets the union of the categories first: concat turns categoricals with
+        # different categories into object columns, which is what the chunks avoid holding
+        categories = {name: union_categoricals([pd.Categorical([], categories=chunk[name].cat.categories)
+                                                for chunk in chunks], ignore_order=True).categories
+                      for name in categorical}
+        chunks = [chunk.copy(deep=False) for chunk in chunks] # new columns, the data is shared
+        for chunk in chunks:
+            for name in categorical:
+                chunk[name] = chunk[name].cat.set_categories(categories[name])
+    return pd.concat(chunks)
+
+'''Yields the pandas chunks of the CSV at source (a path or binary file object) read with pyarrow.'''
+def csv_chunks_pyarrow(source, chunk_bytes):
+    read_options = pa_csv.ReadOptions(block_size=chunk_bytes)
+    convert_options = pa_csv.ConvertOptions(strings_can_be_null=True)
+    # like pandas, keep date/time columns as text; the analysis parses them itself
+    schema = pa_csv.open_csv(source, read_options=read_options, convert_options=convert_options).schema
+    text = {field.name: pa.string() for field in schema
+            if pa.types.is_timestamp(field.type) or pa.types.is_date(field.type) or pa.types.is_time(field.type)}
+    if hasattr(source, "seek"):
+        source.seek(0)
+    if text:
+        convert_options = pa_csv.ConvertOptions(strings_can_be_null=True, column_types=text)
+    for batch in pa_csv.open_csv(source, read_options=read_options, convert_options=convert_options):
+        yield batch.to_pandas()
+
+'''Yields the pandas chunks of the CSV at source read with pandas' chunked reader.'''
+def csv_chunks_pandas(source, chunk_bytes):
+    # rows per chunk from the size of the first chunk_bytes of text
+    yield from pd.read_csv(source, chunksize=max(1000, chunk_bytes // 200))
+
+'''Yields the pandas chunks (row batches) of the Parquet file at source.'''
+def parquet_chunks(source, batch_rows=PARQUET_BATCH_ROWS):
+    if pa is None:
+        raise ValueError("Parquet uploads need pyarrow (pip install pyarrow)")
+    for batch in pa_parquet.ParquetFile(source).iter_batches(batch_size=batch_rows):
+        yield batch.to_pandas()
+
+'''
+Reads, cleans and compacts a chunked stream and returns the DataFrame (indexed by row
+number in the file): columns missing in every row are dropped, then rows with any
+missing value.
+'''
+def read_chunks(chunks):
+    kept, empties, columns, not_empty, offset = [], [], None, set(), 0
+    for chunk in chunks:
+        if columns is None:
+            columns = list(chunk.columns)
+        # index of the rows in the file, like a single read_csv
+        chunk.index = pd.RangeIndex(offset, offset + len(chunk))
+        offset += len(chunk)
+        chunk, empty = clean_chunk(chunk)
+        not_empty |= set(columns) - empty
+        kept.append(compact_dtypes(chunk))
+        empties.append(empty)
+    if columns is None:
+        return pd.DataFrame()
+    # a chunk whose entirely missing column has values elsewhere has a missing value in every row
+    kept = [chunk for chunk, empty in zip(kept, empties) if not (empty & not_empty)]
+    all_empty = [name for name in columns if name not in not_empty]
+    if not kept:
+        return pd.DataFrame(columns=[name for name in columns if name in not_empty])
+    return combine_chunks(kept).drop(columns=all_empty)
+
+'''
+Reads the uploaded file at source (a path, or a file object whose name is given) in
+chunks and returns it cleaned, with compact column types. CSV, Parquet and Zeek log
+(TSV or JSON, see zeekReader) files are accepted; the rotations of one Zeek log can be
+given as lists of sources and names. If pyarrow cannot parse a CSV (e.g. a column
+changes type after the first chunk), it is read again with pandas.
+'''
+def read_table(source, name=None, chunk_bytes=CHUNK_BYTES):
+    sources = list(source) if isinstance(source, (list, tuple)) else [source]
+    names = list(name) if isinstance(name, (list, tuple)) else [name] * len(sources)
+    formats = {file_format(n if n is not None else s) for s, n in zip(sources, names)}
+    if formats <= set(ZEEK_FORMATS):
+        return read_chunks(zeek_chunks(sources, names, chunk_bytes))
+    if len(sources) > 1:
+        raise ValueError("Only Zeek logs can be read from several files")
+    ext = formats.pop()
+    if ext == ".parquet":
+        return read_chunks(parquet_chunks(source))
+    if pa is not None:
+        try:
+            return read_chunks(csv_chunks_pyarrow(source, chunk_bytes))
+        except pa.ArrowInvalid as e:
+            print("pyarrow could not parse the CSV, reading it with pandas:", e)
+            if hasattr(source, "seek"):
+                source.seek(0)
+    return read_chunks(csv_chunks_pandas(source, chunk_bytes))
@@ -0,0 +1,136 @@
+# Store of the cleaned datasets of earlier uploads, keyed by the sha256 of the uploaded
+# file, so that uploading the same capture again reuses its cleaned and typed DataFrame
+# (and its column catalog, see columnCatalog) instead of parsing and profiling it again.
+
+import os
+import pickle
+import tempfile
+import threading
+from collections import OrderedDict
+import pandas as pd
+
+
+class DatasetStore:
+    """
+    LRU cache of cleaned DataFrames and their column catalogs with an optional on-disk
+    store (one Parquet file per dataset, needs pyarrow, and a pickle of its catalog).
+    Safe to share between threads. The frames are stored and handed out without copies,
+    so callers must not modify them in place (find_anomalies builds new frames with drop
+    and assign).
+
+    Parameters:
+        max_bytes: int, bound on the memory used by the in-memory frames (least
+            recently used frames are evicted first)
+        disk_dir: str or None, directory where every dataset is also written so it
+            survives evictions and server restarts
+    """
+
+    def __init__(self, max_bytes=512 * 2**20, disk_dir=None):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.disk_dir = disk_dir
+        self.frames = OrderedDict()
+        self.sizes = {}
+        self.catalogs = {}
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.lock = threading.RLock()
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    def _path(self, digest):
+        return os.path.join(self.disk_dir, digest + ".parquet")
+
+    def _catalog_path(self, digest):
+        return os.path.join(self.disk_dir, digest + ".catalog.pkl")
+
+    def __contains__(self, digest):
+        with self.lock:
+            return digest in self.frames or (self.disk_dir is not None and os.path.exists(self._path(digest)))
+
+    def get(self, digest):
+        """
+        Returns (df, catalog): the dataset stored for digest and a copy of its catalog
+        (None if it was stored without one), or None on a miss.
+        """
+        with self.lock:
+            df = self.frames.get(digest)
+            if df is not None:
+                self.frames.move_to_end(digest)
+                self.hits += 1
+                return df, self._catalog(digest)
+            if self.disk_dir is not None and os.path.exists(self._path(digest)):
+                try:
+                    df = pd.read_parquet(self._path(digest))
+                except Exception as e: # unreadable file (e.g. written by another version)
+                    print("Could not read the stored dataset", digest, e)
+                else:
+                    catalog = None
+                    if os.path.exists(self._catalog_path(digest)):
+                        try:
+                            with open(self._catalog_path(digest), "rb") as f:
+                                catalog = pickle.load(f)
+                        except Exception as e: # profiled again by the caller
+                            print("Could not read the catalog of the stored dataset", digest, e)
+                    self.disk_hits += 1
+                    self._remember(digest, df, catalog)
+                    return df, self._catalog(digest)
+            self.misses += 1
+            return None
+
+    def put(self, digest, df, catalog=None):
+        """Stores df and its catalog (dict of column name -> profile) for digest."""
+        with self.lock:
+            self._remember(digest, df, catalog)
+            if self.disk_dir is not None:
+                try:
+                    self._write(self._path(digest), df.to_parquet)
+                    if catalog is not None:
+                        self._write(self._catalog_path(digest), lambda f: pickle.dump(catalog, f))
+                except Exception as e: # no pyarrow, or columns Parquet cannot hold
+                    print("Could not write the dataset", digest, "to disk:", e)
+
+    def _write(self, path, write):
+        # to a temporary file of this writer first, so readers never see a partial file
+        fd, tmp_path = tempfile.mkstemp(suffix=".tmp", dir=self.disk_dir)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                write(f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def _catalog(self, digest):
+        catalog = self.catalogs.get(digest)
+        # the profiles are not modified, but callers add the columns they derive
+        return None if catalog is None else dict(catalog)
+
+    def _remember(self, digest, df, catalog=None):
+        if digest in self.frames:
+            del self.frames[digest]
+            self.nbytes -= self.sizes.pop(digest)
+            self.catalogs.pop(digest, None)
+        self.frames[digest] = df
+        self.sizes[digest] = int(df.memory_usage(deep=True).sum())
+        if catalog is not None:
+            self.catalogs[digest] = dict(catalog)
+        self.nbytes += self.sizes[digest]
+        # the newest frame is kept even if it alone exceeds max_bytes
+        while self.nbytes > self.max_bytes and len(self.frames) > 1:
+            old, _ = self.frames.popitem(last=False)
+            self.nbytes -= self.sizes.pop(old)
+            self.catalogs.pop(old, None)
+
+    def clear(self):
+        with self.lock:
+            self.frames.clear()
+            self.sizes.clear()
+            self.catalogs.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        with self.lock:
+            return {"hits": self.hits, "disk_hits": self.disk_hits, "misses": self.misses,
+                    "datasets": len(self.frames), "mb": round(self.nbytes / 2**20, 1)}
@@ -0,0 +1,100 @@
+# Incremental pairwise distances for the feature masks explored by the RL.
+# Squared Euclidean distance is additive over features, so the squared distance
+# matrix of a mask is the sum of per-feature contributions (x_f[i] - x_f[j])^2.
+# Masks explored one after another differ by a few bits, so a mask's matrix is
+# derived from the closest cached mask by adding/subtracting a few contributions.
+
+from collections import OrderedDict
+import numpy as np
+from sklearn.utils import check_random_state
+
+
+class DistanceEngine:
+    """
+    Builds (squared) Euclidean distance matrices of feature subsets of X.
+
+    Parameters:
+        X: standardized array, shape (n_samples, n_features)
+        cache_masks: int, number of mask matrices kept (least recently used are evicted)
+        block_rows: int, rows per block when computing a feature contribution, which
+            bounds the temporary memory for large n
+    """
+
+    def __init__(self, X, cache_masks=8, block_rows=2048):
+        self.X = np.asarray(X, dtype=np.float32)
+        self.cache_masks = cache_masks
+        self.block_rows = block_rows
+        self.contributions = {}
+        self.masks = OrderedDict()
+        self.built = 0
+        self.derived = 0
+
+    @staticmethod
+    def memory_needed(n_rows, n_features, cache_masks=8):
+        """Returns the bytes used at most by an engine on data of this shape (float32 matrices)."""
+        return (n_features + cache_masks + 1) * n_rows * n_rows * 4
+
+    def contribution(self, f):
+        """Returns the n x n matrix of squared differences of feature f (computed once)."""
+        contrib = self.contributions.get(f)
+        if contrib is None:
+            x = self.X[:, f]
+            contrib = np.empty((len(x), len(x)), dtype=np.float32)
+            for start in range(0, len(x), self.block_rows):
+                block = x[start:start + self.block_rows, None] - x[None, :]
+                np.multiply(block, block, out=contrib[start:start + self.block_rows])
+            self.contributions[f] = contrib
+        return contrib
+
+    def squared(self, idx):
+        """Returns the squared distance matrix of the features in idx (do not modify it)."""
+        target = frozenset(idx)
+        if target in self.masks:
+            self.masks.move_to_end(target)
+            return self.masks[target]
+
+        # start from the cached mask that needs the fewest feature additions/removals
+        base, diff = None, target
+        for mask in self.masks:
+            if len(mask ^ target) < len(diff):
+                base, diff = mask, mask ^ target
+        if base is None:
+            sq = np.zeros((len(self.X), len(self.X)), dtype=np.float32)
+            self.built += 1
+        else:
+            sq = self.masks[base].copy()
+            self.derived += 1
+        for f in diff:
+            if f in target:
+                sq += self.contribution(f)
+            else:
+                sq -= self.contribution(f)
+        if base is not None:
+            np.maximum(sq, 0, out=sq) # rounding after subtractions
+
+        self.masks[target] = sq
+        while len(self.masks) > self.cache_masks:
+            self.masks.popitem(last=False)
+        return sq
+
+    def distances(self, idx):
+        """Returns the Euclidean distance matrix of the features in idx."""
+        return np.sqrt(self.squared(idx))
+
+    def stats(self):
+        return {"built": self.built, "derived": self.derived,
+                "cached_features": len(self.contributions), "cached_masks": len(self.masks)}
+
+
+'''
+Same estimate as sklearn.cluster.estimate_bandwidth (mean distance to the
+quantile-th nearest neighbour over a random subset of the rows), computed from a
+precomputed distance matrix instead of a new nearest-neighbours index.
+'''
+def estimate_bandwidth_from_distances(distances, quantile=0.3, n_samples=None, random_state=0):
+    idx = np.arange(len(distances))
+    if n_samples is not None:
+        idx = check_random_state(random_state).permutation(len(distances))[:n_samples]
+    n_neighbors = max(1, int(len(idx) * quantile))
+    sub = distances[np.ix_(idx, idx)]
+    return float(np.partition(sub, n_neighbors - 1, axis=1)[:, n_neighbors - 1].mean())
@@ -1,5 +1,6 @@
 from fastapi import FastAPI, File, UploadFile, HTTPException, Form
 from backend.backendInterface import add_data, find_anomalies, get_output,backend_data
+from backend.dataIngest import file_format
 from fastapi.middleware.cors import CORSMiddleware
 import logging
 from fastapi import Request
@@ -7,6 +8,7 @@ from fastapi import Request
 
 # Mount routers
 from backend.api.intent import router as intent_router
+from backend.api.upload import router as upload_router
 app = FastAPI()
 
 # Allow frontend to call API from a different origin/port
@@ -19,13 +21,16 @@ app.add_middleware(
 
 # LLM routes
 app.include_router(intent_router)
+app.include_router(upload_router)
 # app.include_router(interpret_router)
 
 # Original routes
 @app.post("/add_data/")
 async def api_add_data(request: Request, file: UploadFile = File(...)):
-    if not file.filename.lower().endswith(".csv"):
-        raise HTTPException(status_code=400, detail="Only CSV files are allowed")
+    try:
+        file_format(file.filename)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     try:
         # Parse ALL form fields at once
         form = await request.form()   # <-- this returns a FormData mapping
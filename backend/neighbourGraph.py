@@ -0,0 +1,133 @@
+# Nearest-neighbour structures of a feature mask, shared by the DBSCAN and MeanShift
+# evaluations in reinforcementLearning so that the spatial index, the k-distance
+# profile, the radius-neighbours graph and the bandwidth estimate are built once per
+# mask instead of once per fit.
+
+from collections import OrderedDict
+import numpy as np
+from sklearn.cluster import estimate_bandwidth
+from sklearn.neighbors import NearestNeighbors
+from backend.distanceEngine import estimate_bandwidth_from_distances
+
+
+'''
+Returns the index of the knee of the increasing curve y: the point farthest below
+the chord from its first to its last point, both axes scaled to [0, 1].
+'''
+def knee_index(y):
+    y = np.asarray(y, dtype=float)
+    if len(y) < 3 or y[-1] == y[0]:
+        return len(y) - 1
+    x = np.linspace(0, 1, len(y))
+    return int(np.argmax(x - (y - y[0]) / (y[-1] - y[0])))
+
+
+class NeighbourGraph:
+    """
+    Nearest-neighbour index (a KD-/ball tree chosen by sklearn, or the precomputed
+    distances) of one feature mask, with its k-distance profiles, radius-neighbours
+    graph and MeanShift bandwidths computed on demand and kept.
+
+    Parameters:
+        X: standardized array, shape (n_samples, n_features)
+        distances: optional pairwise distance matrix of X, used instead of a tree
+    """
+
+    def __init__(self, X, distances=None):
+        self.X = X
+        self.distances = distances
+        self.index = None
+        self.profiles = {}
+        self.graph = None
+        self.radius = 0.0
+        self.bandwidths = {}
+
+    def neighbours(self):
+        """Returns the fitted NearestNeighbors index."""
+        if self.index is None:
+            if self.distances is not None:
+                self.index = NearestNeighbors(metric="precomputed").fit(self.distances)
+            else:
+                self.index = NearestNeighbors().fit(self.X)
+        return self.index
+
+    def queries(self):
+        return self.distances if self.distances is not None else self.X
+
+    def k_distances(self, k):
+        """Returns the sorted distances of every row to its k-th nearest row (the row itself included)."""
+        profile = self.profiles.get(k)
+        if profile is None:
+            kth, _ = self.neighbours().kneighbors(self.queries(), n_neighbors=min(k, len(self.X)))
+            profile = self.profiles[k] = np.sort(kth[:, -1])
+        return profile
+
+    def knee_eps(self, min_samples):
+        """
+        Returns a DBSCAN eps for min_samples: the knee of the k-distance profile, so
+        rows left of the knee are core points and the steep tail is noise.
+        """
+        profile = self.k_distances(min_samples)
+        eps = profile[knee_index(profile)]
+        if eps <= 0: # most rows are duplicates of their neighbours
+            eps = profile[profile > 0].min() if (profile > 0).any() else 0.5
+        return float(eps)
+
+    def radius_graph(self, radius):
+        """
+        Returns the sparse radius-neighbours graph (distances, rows sorted) of radius
+        at least radius. DBSCAN on it with metric="precomputed" and any eps <= radius
+        gives the same clusters as on X, so one graph serves a whole eps sweep.
+        """
+        if self.graph is None or radius > self.radius:
+            self.graph = self.neighbours().radius_neighbors_graph(self.queries(), radius=radius, mode="distance",
+                                                                  sort_results=True)
+            self.radius = radius
+        return self.graph
+
+    def bandwidth(self, quantile, n_samples):
+        """Returns sklearn's estimate_bandwidth(X, quantile=quantile, n_samples=n_samples) (random_state=0)."""
+        key = (quantile, n_samples)
+        if key not in self.bandwidths:
+            if self.distances is not None:
+                bandwidth = estimate_bandwidth_from_distances(self.distances, quantile=quantile, n_samples=n_samples)
+            elif n_samples is None or n_samples >= len(self.X):
+                # the sample is all of the rows, so the index of X answers the kNN query
+                k = max(1, int(len(self.X) * quantile))
+                kth, _ = self.neighbours().kneighbors(self.X, n_neighbors=k)
+                bandwidth = float(kth[:, -1].mean())
+            else:
+                bandwidth = estimate_bandwidth(self.X, quantile=quantile, n_samples=n_samples)
+            self.bandwidths[key] = bandwidth
+        return self.bandwidths[key]
+
+
+class NeighbourGraphCache:
+    """
+    LRU cache of the NeighbourGraph of the last max_masks feature masks.
+
+    Parameters:
+        max_masks: int, number of graphs kept
+    """
+
+    def __init__(self, max_masks=4):
+        self.max_masks = max_masks
+        self.graphs = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, X, distances=None):
+        """Returns the graph of key (e.g. the mask and rows of X), building it from X if needed."""
+        graph = self.graphs.get(key)
+        if graph is not None:
+            self.graphs.move_to_end(key)
+            self.hits += 1
+            return graph
+        self.misses += 1
+        graph = self.graphs[key] = NeighbourGraph(X, distances)
+        while len(self.graphs) > self.max_masks:
+            self.graphs.popitem(last=False)
+        return graph
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "cached_masks": len(self.graphs)}
@@ -0,0 +1,188 @@
+# Sparse data structures for the Q-learning in reinforcementLearning.RL.
+# States are feature bitmasks stored as plain python ints, so any number of
+# features works and memory grows with the number of touched states instead of 2**F.
+
+import heapq
+import random
+import numpy as np
+
+
+class SparseQTable:
+    """
+    Q-table that only stores the rows of states that have been updated.
+    Rows of untouched states read as all zeros.
+
+    The bookkeeping of the search is kept up to date by set, so its cost does not grow
+    with the number of states: the change since the last mark (for the convergence
+    check), the Q value sum of every row, and lazy max-heaps of the row sums (for
+    top_states) and of the updated cells (for argmax and top_pairs). A heap entry is
+    stale once its state or cell has been updated again and is dropped when popped.
+
+    Parameters:
+        num_actions: int, number of actions (algorithms) per state
+    """
+
+    def __init__(self, num_actions):
+        self.num_actions = num_actions
+        self.rows = {}
+        self.sums = {}
+        self.state_heap = [] # (-row sum, state)
+        self.cell_heap = []  # (-value, state, action)
+        self.marked = {}     # (state, action) -> value at the last mark, for the cells updated since
+
+    def row(self, state):
+        """Returns the Q values of state (a read-only zero row if state was never updated)."""
+        row = self.rows.get(state)
+        if row is None:
+            row = np.zeros(self.num_actions)
+            row.flags.writeable = False
+        return row
+
+    def get(self, state, action):
+        row = self.rows.get(state)
+        return 0.0 if row is None else row[action]
+
+    def set(self, state, action, value):
+        row = self.rows.get(state)
+        if row is None:
+            row = self.rows[state] = np.zeros(self.num_actions)
+            self.sums[state] = 0.0
+        old = float(row[action])
+        self.marked.setdefault((state, action), old)
+        row[action] = value
+        self.sums[state] += float(row[action]) - old
+        heapq.heappush(self.state_heap, (-self.sums[state], state))
+        heapq.heappush(self.cell_heap, (-float(row[action]), state, action))
+        # stale entries pile up with the updates; drop them once they dominate
+        if len(self.cell_heap) > 4 * len(self.rows) * self.num_actions + 64:
+            self.state_heap = [(-total, state) for state, total in self.sums.items()]
+            cells = {entry[1:]: entry for entry in self.cell_heap if self._valid_cell(entry)}
+            self.cell_heap = list(cells.values())
+            heapq.heapify(self.state_heap)
+            heapq.heapify(self.cell_heap)
+
+    def mark(self):
+        """Starts a new interval for diff_since_mark."""
+        self.marked = {}
+
+    def diff_since_mark(self):
+        """Returns the sum of absolute differences between the Q values now and at the last mark."""
+        return float(sum(abs(self.rows[state][action] - old) for (state, action), old in self.marked.items()))
+
+    def _valid_state(self, entry):
+        return self.sums[entry[1]] == -entry[0]
+
+    def _valid_cell(self, entry):
+        return self.rows[entry[1]][entry[2]] == -entry[0]
+
+    def _top(self, heap, k, valid):
+        """Pops the k best distinct valid entries of heap (dropping stale ones), pushes them back and returns them."""
+        top, seen = [], set()
+        while heap and len(top) < k:
+            entry = heapq.heappop(heap)
+            if entry[1:] not in seen and valid(entry):
+                seen.add(entry[1:])
+                top.append(entry)
+        for entry in top:
+            heapq.heappush(heap, entry)
+        return top
+
+    def top_states(self, k):
+        """Returns up to k touched states with the highest sum of Q values, in increasing order of the sum."""
+        top = self._top(self.state_heap, k, self._valid_state)
+        return [state for _, state in reversed(top)]
+
+    def top_pairs(self, k):
+        """Returns up to k updated (state, action) pairs with the highest Q values, best first."""
+        top = self._top(self.cell_heap, k, self._valid_cell)
+        return [(state, int(a)) for _, state, a in top]
+
+    def argmax(self):
+        """Returns the updated (state, action) with the highest Q value, preferring the lowest state on ties."""
+        top = self.top_pairs(1)
+        return top[0] if top else (None, None)
+
+    def __len__(self):
+        return len(self.rows)
+
+
+class VisitedPairs:
+    """
+    Set of visited (state, action) pairs over the states 1 .. num_configs - 1
+    (state 0, no features selected, is never visited).
+
+    Parameters:
+        num_configs: int, number of feature configurations (2**F)
+        num_actions: int, number of actions (algorithms) per state
+    """
+
+    def __init__(self, num_configs, num_actions):
+        self.num_configs = num_configs
+        self.num_actions = num_actions
+        self.total = (num_configs - 1) * num_actions
+        self.pairs = set()
+
+    def add(self, state, action):
+        self.pairs.add((state, action))
+
+    def __contains__(self, pair):
+        return pair in self.pairs
+
+    def __len__(self):
+        return len(self.pairs)
+
+    def has_unvisited(self):
+        return len(self.pairs) < self.total
+
+    def random_unvisited(self, rng=random):
+        """
+        Returns a uniformly random unvisited pair (drawn with rng, a random.Random or the
+        random module), or None if all pairs were visited.
+        Uses rejection sampling while most pairs are unvisited and enumerates the
+        remaining ones otherwise (which only happens for small state spaces).
+        """
+        unvisited = self.total - len(self.pairs)
+        if unvisited <= 0:
+            return None
+        if unvisited * 8 >= self.total:
+            while True:
+                pair = (rng.randrange(1, self.num_configs), rng.randrange(self.num_actions))
+                if pair not in self.pairs:
+                    return pair
+        remaining = [(s, a) for s in range(1, self.num_configs) for a in range(self.num_actions)
+                     if (s, a) not in self.pairs]
+        return rng.choice(remaining)
+
+
+class TopLabelStore:
+    """
+    Keeps the cluster labels of only the k (state, action) pairs with the highest
+    Q values, so label memory does not grow with the number of evaluations.
+
+    Parameters:
+        k: int, number of pairs whose labels are kept
+    """
+
+    def __init__(self, k):
+        self.k = k
+        self.labels = {}
+        self.values = {}
+
+    def update(self, pair, value, labels):
+        """Records the new Q value of pair and keeps its labels if it is among the top k."""
+        if self.k <= 0:
+            return
+        if pair not in self.labels and len(self.labels) >= self.k:
+            lowest = min(self.values, key=self.values.get)
+            if value <= self.values[lowest]:
+                return
+            del self.labels[lowest], self.values[lowest]
+        self.labels[pair] = labels
+        self.values[pair] = value
+
+    def get(self, pair):
+        """Returns the labels of pair, or None if they were evicted (or never kept)."""
+        return self.labels.get(pair)
+
+    def nbytes(self):
+        return sum(labels.nbytes for labels in self.labels.values())
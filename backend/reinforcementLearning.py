@@ -3,19 +3,154 @@ import seaborn as sb
 import pandas as pd
 import numpy as np
 from scipy.stats import multivariate_normal
-from sklearn.metrics import silhouette_score
 from sklearn.cluster import KMeans
 from sklearn.mixture import GaussianMixture
 from sklearn.cluster import DBSCAN
-from sklearn_extra.cluster import KMedoids
-from sklearn.cluster import MeanShift, estimate_bandwidth
+from sklearn.cluster import MeanShift
+from sklearn.cluster import MiniBatchKMeans, Birch
+try:
+    from sklearn.cluster import HDBSCAN
+except ImportError: # scikit-learn < 1.3, the hdbscan action is unavailable
+    HDBSCAN = None
 from sklearn.preprocessing import StandardScaler
+from sklearn.utils import check_random_state
 import random
+import os
+import sys
+import threading
+import zlib
+import hashlib
+import time
+import resource
+import tracemalloc
+import logging
+import queue
+import multiprocessing
+from dotenv import load_dotenv
+try:
+    import psutil
+except ImportError: # the peak RSS of the server process during a run is not reported
+    psutil = None
+from backend.rewardCache import RewardCache, dataset_fingerprint, compact_labels
+from backend.qTable import SparseQTable, VisitedPairs, TopLabelStore
+from backend.rewardMetrics import cluster_score, REWARD_MODES, FullSilhouette
+from backend.distanceEngine import DistanceEngine
+from backend.rewardMetrics import silhouette_from_distances, fidelity_order
+from backend.searchStrategies import SEARCH_STRATEGIES
+from backend.claraMedoids import clara_kmedoids, clara_needed, kmedoids_from_rows
+from backend.neighbourGraph import NeighbourGraph, NeighbourGraphCache
+
+load_dotenv() # deployment defaults (ADAS_* variables below) can live in backend/.env
+
+# how clusterings are scored when no reward mode is given (see score_labels)
+DEFAULT_REWARD_MODE = {"mode": "exact", "sample_size": 2000}
+# the engine of the run a worker process evaluates pairs for (see init_worker)
+WORKER_ENGINE = None
+# runs of this process whose evaluations trace memory (see trace_memory)
+MEMORY_TRACING = {"runs": 0, "lock": threading.Lock()}
+
+# parameters passed to each algorithm function by algorithm_prep (also part of the reward cache key)
+ALGORITHM_PARAMS = {"dbscan": {"eps": 0.5, "min_samples": 5},
+                    "meanshift": {"quantile": 0.3, "n_samples": 500},
+                    "kmedoids": {"n_clusters": 2},
+                    "em": {"n_clusters": 2},
+                    "kmeans": {"n_clusters": 2, "max_iter": 300},
+                    "minibatch_kmeans": {"batch_size": 4096, "max_iter": 100},
+                    "birch": {"threshold": 0.5},
+                    "hdbscan": {"min_cluster_size": 5}}
+
+# shared across runs so reruns and re-uploads of the same data reuse earlier evaluations.
+# ADAS_REWARD_CACHE_DIR enables the on-disk store.
+REWARD_CACHE = RewardCache(max_entries=int(os.getenv("ADAS_REWARD_CACHE_SIZE", "4096")),
+                           max_bytes=int(os.getenv("ADAS_REWARD_CACHE_MB", "256")) * 2**20,
+                           disk_dir=os.getenv("ADAS_REWARD_CACHE_DIR"))
+
+# default settings of a run, set per deployment with the ADAS_RL_* environment variables.
+# only the ones in QUERY_OPTIONS can be overridden for a single find_anomalies call.
+RL_CONFIG = {
+    "max_iterations": int(os.getenv("ADAS_RL_MAX_ITERATIONS", "10000")),
+    "time_budget": float(os.getenv("ADAS_RL_TIME_BUDGET", "0")), # seconds of search, 0 = no limit
+    "max_evals": int(os.getenv("ADAS_RL_MAX_EVALS", "0")),       # clusterings run (cached pairs are free), 0 = no limit
+    "n_workers": int(os.getenv("ADAS_RL_WORKERS", "1")),       # processes used to evaluate pairs concurrently
+    "batch_size": int(os.getenv("ADAS_RL_BATCH_SIZE", "0")),   # pairs evaluated per iteration, 0 = n_workers
+    "label_top_k": int(os.getenv("ADAS_RL_LABEL_TOP_K", "10")), # pairs with the best Q values whose labels are kept
+    "reward_mode": os.getenv("ADAS_RL_REWARD_MODE", "exact"),   # exact, sampled, simplified or calinski
+    "reward_sample_size": int(os.getenv("ADAS_RL_REWARD_SAMPLE_SIZE", "2000")), # rows scored in sampled mode
+    "distance_cache_mb": int(os.getenv("ADAS_RL_DISTANCE_CACHE_MB", "512")), # memory for incremental distance matrices, 0 = off
+    "flip_bias": float(os.getenv("ADAS_RL_FLIP_BIAS", "0")),   # chance an explore step flips one bit of the last state
+    "silhouette_cache_mb": int(os.getenv("ADAS_RL_SILHOUETTE_CACHE_MB", "1024")), # full-feature distances kept in RAM up to this size
+    "silhouette_disk_mb": int(os.getenv("ADAS_RL_SILHOUETTE_DISK_MB", "0")),  # ... or memory-mapped to disk up to this size, 0 = never
+    "silhouette_mmap_dir": os.getenv("ADAS_RL_SILHOUETTE_MMAP_DIR"),              # where the memory-mapped file goes
+    "strategy": os.getenv("ADAS_RL_STRATEGY", "qlearning"),     # qlearning or one of searchStrategies.SEARCH_STRATEGIES
+    "beam_width": int(os.getenv("ADAS_RL_BEAM_WIDTH", "3")),     # masks kept per level by the beam strategy
+    "halving_candidates": int(os.getenv("ADAS_RL_HALVING_CANDIDATES", "64")), # random pairs the halving strategy starts from
+    "halving_eta": int(os.getenv("ADAS_RL_HALVING_ETA", "3")),   # 1/eta of the pairs survive each halving round
+    "halving_min_rows": int(os.getenv("ADAS_RL_HALVING_MIN_ROWS", "200")), # rows of the first halving round (at least)
+    "fidelity_rows": int(os.getenv("ADAS_RL_FIDELITY_ROWS", "0")), # rows of the lowest fidelity evaluations, 0 = always all rows
+    "fidelity_eta": int(os.getenv("ADAS_RL_FIDELITY_ETA", "3")),   # rows grow and promotions shrink by this factor per fidelity
+    "fidelity_confirm": int(os.getenv("ADAS_RL_FIDELITY_CONFIRM", "3")), # best pairs refit on all rows to pick the final one
+    "warm_start": os.getenv("ADAS_RL_WARM_START", "1") == "1", # start KMeans/KMedoids/EM from the clusters of a neighbouring mask
+    "kmedoids_mode": os.getenv("ADAS_RL_KMEDOIDS_MODE", "auto"), # full, clara (sampled) or auto (clara for large/low memory)
+    "clara_rows": int(os.getenv("ADAS_RL_CLARA_ROWS", "20000")), # rows above which auto uses clara
+    "clara_draws": int(os.getenv("ADAS_RL_CLARA_DRAWS", "5")),   # samples clara runs KMedoids on
+    "clara_sample_size": int(os.getenv("ADAS_RL_CLARA_SAMPLE_SIZE", "1000")), # rows per clara sample
+    "dbscan_eps": os.getenv("ADAS_RL_DBSCAN_EPS", "auto"),      # DBSCAN eps, auto = knee of the k-distance profile
+    "dbscan_eps_sweep": os.getenv("ADAS_RL_DBSCAN_EPS_SWEEP", "0.75,1,1.5"), # factors of eps tried, the best scoring is kept
+    "neighbour_cache_masks": int(os.getenv("ADAS_RL_NEIGHBOUR_CACHE_MASKS", "4")), # masks whose neighbour graphs are kept
+    "em_covariance": os.getenv("ADAS_RL_EM_COVARIANCE", "full"),  # EM covariance: full, tied, diag or spherical
+    "em_components": os.getenv("ADAS_RL_EM_COMPONENTS", "2"),     # EM components, or bic to pick 2..5 by BIC
+    "em_max_init": int(os.getenv("ADAS_RL_EM_MAX_INIT", "10")),   # most EM restarts per number of components
+    "em_agree": int(os.getenv("ADAS_RL_EM_AGREE", "2")),          # stop once this many restarts agree on the best fit, 0 = never
+    "actions": os.getenv("ADAS_RL_ACTIONS", "dbscan,meanshift,kmedoids,em,kmeans,minibatch_kmeans,birch,hdbscan"), # ACTION_REGISTRY keys
+    "max_rows_quadratic": int(os.getenv("ADAS_RL_MAX_ROWS_QUADRATIC", "20000")), # rows above which quadratic actions are excluded
+    "max_rows_nlogn": int(os.getenv("ADAS_RL_MAX_ROWS_NLOGN", "200000")),      # rows above which n log n actions are excluded
+    "cost_time_weight": float(os.getenv("ADAS_RL_COST_TIME_WEIGHT", "0")),     # reward lost per log10(1 + seconds / cost_time_ref), 0 = off
+    "cost_time_ref": float(os.getenv("ADAS_RL_COST_TIME_REF", "1")),           # seconds of a clustering considered costly
+    "cost_memory_weight": float(os.getenv("ADAS_RL_COST_MEMORY_WEIGHT", "0")), # reward lost per log10(1 + MB / cost_memory_ref), 0 = off
+    "cost_memory_ref": float(os.getenv("ADAS_RL_COST_MEMORY_REF", "100")),     # MB of a clustering considered costly
+    "cost_track_memory": os.getenv("ADAS_RL_COST_TRACK_MEMORY", "0") == "1",   # measure memory even if its weight is 0 (slows fits down)
+    "eval_timeout": float(os.getenv("ADAS_RL_EVAL_TIMEOUT", "0")),   # seconds a clustering may run (in a killable worker process), 0 = no limit
+    "timeout_reward": float(os.getenv("ADAS_RL_TIMEOUT_REWARD", "-1")), # immediate reward of a clustering that timed out
+    "seed": int(os.getenv("ADAS_RL_SEED")) if os.getenv("ADAS_RL_SEED") else None, # seed of a reproducible run, None = random
+}
+# settings of the search a find_anomalies call may set through its query dict (see query_options).
+# workers, timeouts, memory and disk settings are deployment settings and come only from ADAS_RL_*
+QUERY_OPTIONS = ("max_iterations", "time_budget", "max_evals", "strategy", "reward_mode", "reward_sample_size", "seed",
+                 "actions")
 
-OG_FEATURES = None
-ALGORITHMS = None
-NUM_ALG = None
-FEATURES = None
+'''
+Returns the RL settings given in query (dict) for a single run. Only QUERY_OPTIONS
+are accepted, budgets and the reward sample size may only tighten the deployment's (a
+budget of 0, no limit, only if the deployment has none either). Raises ValueError for any other setting or an
+invalid value; strategy, reward mode and action names are checked by RLEngine.
+'''
+def query_options(query):
+    options = {k: query[k] for k in RL_CONFIG if query.get(k) is not None}
+    for name, value in options.items():
+        if name not in QUERY_OPTIONS:
+            raise ValueError(f"{name} is a deployment setting (ADAS_RL_* environment variables), not a query option")
+        if name in ("strategy", "reward_mode"):
+            if not isinstance(value, str):
+                raise ValueError(f"{name} must be a string")
+        elif name == "actions":
+            if not (isinstance(value, str) or isinstance(value, (list, tuple)) and value and all(isinstance(a, str) for a in value)):
+                raise ValueError("actions must be a comma separated string or a list of action names")
+        else:
+            types = (int, float) if name == "time_budget" else int
+            if isinstance(value, bool) or not isinstance(value, types) or not np.isfinite(value):
+                raise ValueError(f"{name} must be a{' number' if name == 'time_budget' else 'n integer'}, got {value!r}")
+            if name == "seed":
+                if not 0 <= value < 2**32:
+                    raise ValueError(f"seed must be between 0 and 2**32 - 1, got {value}")
+                continue
+            # max_iterations and reward_sample_size have no "no limit" value, the deployment's is always an upper bound
+            limit = RL_CONFIG[name]
+            lowest = 1 if name in ("max_iterations", "reward_sample_size") else 0
+            if limit > 0 and not 0 < value <= limit:
+                raise ValueError(f"{name} must be above 0 and at most {limit} (the deployment's), got {value}")
+            if value < lowest:
+                raise ValueError(f"{name} must be at least {lowest}, got {value}")
+    return options
 
 ##### ALGORITHMS #####
 """
@@ -23,42 +158,39 @@ Performs KMeans clustering using the data from selected_features.
 If mode = 0, the silhouette score of the clustering is returned.
 If mode = 1, the labels of the clustering is returned.
 """
-def kmeans_clustering(selected_features,mode, n_clusters=2, max_iter=300):
+def kmeans_clustering(selected_features,mode, n_clusters=2, max_iter=300, distances=None, warm_start=None,
+                      reward_mode=None, random_state=None):
     """
     Perform KMeans clustering on the input samples
     
     Parameters:
-        samples: array-like, shape (n_samples, n_features)
+        selected_features: standardized array, shape (n_samples, n_features)
         n_clusters: int, number of clusters (default=2)
         max_iter: int, maximum iterations (default=300)
+        distances: optional pairwise distance matrix of selected_features, used for scoring
+        warm_start: optional dict of k -> labels of a neighbouring mask, see best_k_clustering
+        reward_mode: dict of the reward mode and sample size (see score_labels)
+        random_state: int or None, seed of the fits and of the scoring
     
     Returns:
         silhouette_coef: silhouette coefficient score
     """
-    # Filter the selected features
-    X = selected_features
-    
-    # Standardize selected features
-    scaler = StandardScaler()
-    X_scaled = scaler.fit_transform(X)
-    best_k = n_clusters
-
-    try:
-        k_options = range(2, 6)
-        best_k = max(k_options, key=lambda k: silhouette_score(X_scaled, KMeans(n_clusters=k).fit_predict(X_scaled)))
-    except:
-        best_k = 2
-
-    k_means = KMeans(n_clusters=best_k, max_iter=max_iter)
-    k_means.fit(X_scaled)
+    # selected features are already standardized (see state_to_features)
+    X_scaled = selected_features
+
+    def fit(k):
+        # start from the clusters of the neighbouring mask, moved to this feature space
+        init = warm_centroids(X_scaled, warm_start.get(k), k) if warm_start else None
+        if init is None:
+            return KMeans(n_clusters=k, max_iter=max_iter, random_state=random_state).fit_predict(X_scaled)
+        return KMeans(n_clusters=k, max_iter=max_iter, init=init, n_init=1, random_state=random_state).fit_predict(X_scaled)
+
+    # the k-search keeps the best fit, so there is no refit at the chosen k
+    silhouette_coef, labels = best_k_clustering(X_scaled, fit, range(2, 6), distances, warm_start, reward_mode, random_state)
     if mode == 0:
-        try:
-            silhouette_coef = silhouette_score(X_scaled, k_means.labels_)
-        except ValueError:
-            silhouette_coef = -1  # Assigning lowest score if clustering fails
-        return silhouette_coef, k_means.labels_
+        return silhouette_coef, labels
     if mode == 1:
-        return k_means.labels_
+        return labels
 
 
 """
@@ -66,37 +198,61 @@ Performs EM clustering using the data from selected_features.
 If mode = 0, the silhouette score of the clustering is returned.
 If mode = 1, the labels of the clustering is returned.
 """
-def em_clustering(selected_features, mode, n_clusters=2):
+def em_clustering(selected_features, mode, n_clusters=2, distances=None, warm_start=None,
+                  covariance_type="full", components=None, max_init=10, agree=2, reward_mode=None, random_state=None):
     """
     Perform EM Clustering on selected features and return silhouette score.
+
+    Parameters:
+    -----------
+    n_clusters : int
+        Number of components, unless components is given
+    components : iterable of int, optional
+        Numbers of components to try, the fit with the lowest BIC is used
+    covariance_type : str
+        full, tied, diag or spherical
+    max_init, agree : int
+        Restarts per number of components, see fit_em
+    warm_start : dict, optional
+        k -> labels of a neighbouring mask, see best_k_clustering; the first restart
+        starts from the means of their clusters
+    reward_mode : dict, optional
+        Reward mode and sample size of the scoring, see score_labels
+    random_state : int, optional
+        Seed of the restarts and of the scoring
         
     Returns:
     --------
     float
         Silhouette score of the clustering (-1 if clustering fails)
     """
-    # Filter the selected features
-    X = selected_features
-    
-    # Standardize selected features
-    scaler = StandardScaler()
-    X_scaled = scaler.fit_transform(X)
-
-    # Initialize and fit the EM model
-    em_model = GaussianMixture(
-        n_components=n_clusters,
-        #random_state=0, #THOUGHTS: We can improve this later to have an array of seeds to select from to observe variations
-        n_init=10  # Multiple initializations to avoid local optima
-    )
-    
+    # selected features are already standardized (see state_to_features)
+    X_scaled = selected_features
+
+    # Initialize and fit the EM model for every number of components
+    em_model, em_labels, best_bic = None, None, np.inf
+    for k in (components or [n_clusters]):
+        try:
+            means_init = warm_centroids(X_scaled, warm_start.get(k), k) if warm_start else None
+            model = fit_em(X_scaled, k, covariance_type, max_init, agree, means_init, random_state=random_state)
+            model_labels = model.predict(X_scaled)
+        except Exception:
+            continue
+        if warm_start is not None:
+            warm_start[k] = compact_labels(model_labels)
+        bic = model.bic(X_scaled) if components else 0
+        if em_model is None or bic < best_bic:
+            em_model, em_labels, best_bic = model, model_labels, bic
    
+    labels = np.zeros(len(X_scaled), dtype=int) # single cluster if clustering fails
     try:
+        if em_model is None:
+            raise ValueError("EM failed for every number of components")
         # Fit the model and get cluster assignments
-        em_model.fit(X_scaled)
-        labels = em_model.predict(X_scaled)
+        labels = em_labels
         
         # Calculate silhouette score
-        silhouette_coef = silhouette_score(X_scaled, labels)
+        silhouette_coef = score_labels(X_scaled, labels, distances, reward_mode, random_state)
     except Exception as e:
         #print(f"Clustering failed: {str(e)}")
         silhouette_coef = -1  # Assigning lowest score if clustering fails
@@ -111,46 +267,58 @@ Performs DBSCAN clustering using the data from selected_features.
 If mode = 0, the silhouette score of the clustering is returned.
 If mode = 1, the labels of the clustering is returned.
 """
-def dbscan_clustering(selected_features, mode, eps=0.5, min_samples=5):
+def dbscan_clustering(selected_features, mode, eps=0.5, min_samples=5, distances=None, eps_sweep=(1.0,), graph=None,
+                      reward_mode=None, random_state=None):
     """
     Perform DBSCAN clustering on selected features
     
     Parameters:
-    selected_features : pandas DataFrame
-        The features selected for clustering
-    eps : float
-        The maximum distance between two samples for them to be considered neighbors
+    selected_features : numpy array
+        The standardized features selected for clustering
+    eps : float or "auto"
+        The maximum distance between two samples for them to be considered neighbors.
+        "auto" takes the knee of the k-distance profile (see NeighbourGraph.knee_eps)
     min_samples : int
         The number of samples in a neighborhood for a point to be considered a core point
+    distances : numpy array, optional
+        Pairwise distance matrix of selected_features, used instead of recomputing distances
+    eps_sweep : tuple of float
+        Factors of eps that are tried, the best scoring clustering is kept
+    graph : NeighbourGraph, optional
+        Neighbour graph of selected_features shared with other evaluations of the same mask
+    reward_mode : dict, optional
+        Reward mode and sample size of the scoring, see score_labels
+    random_state : int, optional
+        Seed of the scoring (DBSCAN itself is deterministic)
         
     Returns:
     float : silhouette coefficient
     dict : additional clustering information
     """
 
-    # Filter the selected features
-    X = selected_features
-    
-    # Standardize selected features
-    scaler = StandardScaler()
-    X_scaled = scaler.fit_transform(X)
+    # selected features are already standardized (see state_to_features)
+    X_scaled = selected_features
+    if graph is None:
+        graph = NeighbourGraph(X_scaled, distances)
+    if eps == "auto":
+        eps = graph.knee_eps(min_samples)
+    eps_options = sorted({eps * factor for factor in eps_sweep})
+    # one radius-neighbours graph at the largest eps serves every eps of the sweep
+    neighbours = graph.radius_graph(eps_options[-1])
     
     # Initialize and fit DBSCAN
     #min_samples = max(5, int(len(X) * 0.01)) # use 1% of the data as the size of the smallest sample, if this value is less than 5, default to 5
-    dbscan = DBSCAN(eps=eps, min_samples=min_samples)
-    labels = dbscan.fit_predict(X_scaled)
-
-    if -1 in labels:
-        labels[labels == -1] = max(labels) + 1
+    def fit(eps):
+        dbscan = DBSCAN(eps=eps, min_samples=min_samples, metric='precomputed')
+        labels = dbscan.fit_predict(neighbours)
+        if -1 in labels:
+            labels[labels == -1] = max(labels) + 1
+        return labels
 
-    # Get number of clusters (excluding noise points which are labeled -1, K Medoids does not have noise points)
-    n_clusters = len(set(labels))
-    
     # calculate silhouette score if more than one cluster and  noise points
-    if n_clusters > 1:
-        silhouette_coef = silhouette_score(X_scaled, labels)
-    else:
-        silhouette_coef = -1  # Assign lowest score if clustering fails
+    # (a single cluster scores -1)
+    silhouette_coef, labels = best_k_clustering(X_scaled, fit, eps_options, distances, reward_mode=reward_mode,
+                                                random_state=random_state)
 
     
     # NOTE: -- Uncomment when we analyze and optimize ---- Additional clustering information
@@ -172,33 +340,27 @@ Performs KMediods clustering using the data from selected_features.
 If mode = 0, the silhouette score of the clustering is returned.
 If mode = 1, the labels of the clustering is returned.
 """
-def kmedoids_clustering(selected_features, mode, n_clusters=2):
-    # Filter the selected features
-    X = selected_features
-    
-    # Standardize selected features
-    scaler = StandardScaler()
-    X_scaled = scaler.fit_transform(X)
-    best_k = n_clusters
-    try:
-        k_options = range(2, 6)
-        best_k = max(k_options, key=lambda k: silhouette_score(X_scaled, KMedoids(n_clusters=k, method='alternate', nit='k-medoids++', max_iter=1500).fit_predict(X_scaled)))
-    except:
-        best_k = 2
-
-     # Initialize and fit the K-Medoids model
-    kmedoids = KMedoids(n_clusters=best_k, method='alternate', init='k-medoids++', max_iter=1500)
-    
-
-    # Calculate silhouette score
-    try:
-        labels = kmedoids.fit_predict(X_scaled)
-        if len(set(labels)) > 1:
-            silhouette_coef = silhouette_score(X_scaled, labels)
-        else:
-            silhouette_coef = -1 # Assigning lowest score if there is only 1 cluster
-    except Exception as e:
-        silhouette_coef = -1  # Assigning lowest score if clustering fails
+def kmedoids_clustering(selected_features, mode, n_clusters=2, distances=None, warm_start=None,
+                        method="auto", clara_rows=20000, clara_draws=5, clara_sample_size=1000, reward_mode=None,
+                        random_state=None):
+    # selected features are already standardized (see state_to_features)
+    X_scaled = selected_features
+    # the full KMedoids needs the n x n distance matrix; large captures use sampled (CLARA) medoids
+    use_clara = method == "clara" or (method == "auto" and clara_needed(len(X_scaled), clara_rows))
+
+    def fit(k):
+        # start from the medoids of the neighbouring mask's clusters in this feature space
+        init = warm_medoids(X_scaled, warm_start.get(k), k, distances) if warm_start else None
+        if use_clara:
+            return clara_kmedoids(X_scaled, k, n_draws=clara_draws, sample_size=clara_sample_size,
+                                  init=init, rng=np.random.default_rng(random_state))[0]
+        # Initialize and fit the K-Medoids model (from the warm medoid rows, k-medoids++ without them)
+        kmedoids = kmedoids_from_rows(k, init, max_iter=1500, random_state=random_state)
+        return kmedoids.fit_predict(X_scaled)
+
+    # the k-search keeps the best fit, so there is no refit at the chosen k
+    # (a single cluster or a failed fit scores -1)
+    silhouette_coef, labels = best_k_clustering(X_scaled, fit, range(2, 6), distances, warm_start, reward_mode, random_state)
     if mode == 0:
         return silhouette_coef, labels
     if mode == 1:
@@ -210,22 +372,22 @@ Performs Mean Shift clustering using the data from selected_features.
 If mode = 0, the silhouette score of the clustering is returned.
 If mode = 1, the labels of the clustering is returned.
 """
-def meanshift_clustering(selected_features, mode, quantile=0.3, n_samples=500):
-    # Filter the selected features
-    X = selected_features
-    
-    # Standardize selected features
-    scaler = StandardScaler()
-    X_scaled = scaler.fit_transform(X)
-
-    # Estimate optimal bandwidth
-    bandwidth = estimate_bandwidth(X_scaled, quantile=quantile, n_samples=n_samples)
+def meanshift_clustering(selected_features, mode, quantile=0.3, n_samples=500, distances=None, graph=None,
+                         reward_mode=None, random_state=None):
+    # selected features are already standardized (see state_to_features)
+    X_scaled = selected_features
+
+    # Estimate optimal bandwidth (kept in the mask's neighbour graph, from the distance matrix when one is given)
+    if graph is None:
+        graph = NeighbourGraph(X_scaled, distances)
+    bandwidth = graph.bandwidth(quantile, n_samples)
     if bandwidth <= 0:
         bandwidth = 1.0  # Fallback in case of extremely small bandwidth
         
     # Initialize and fit the Mean Shift model
     meanshift = MeanShift(bandwidth=bandwidth, bin_seeding=True)
     # Calculate silhouette score
+    labels = np.zeros(len(X_scaled), dtype=int) # single cluster if clustering fails
     try:
         # print("in try")
         labels = meanshift.fit_predict(X_scaled)
@@ -237,7 +399,7 @@ def meanshift_clustering(selected_features, mode, quantile=0.3, n_samples=500):
         #n_clusters = len(np.unique(labels))
         #print(f"Number of clusters found: {n_clusters}")
         if n_clusters > 1:
-            silhouette_coef = silhouette_score(X_scaled, labels)
+            silhouette_coef = score_labels(X_scaled, labels, distances, reward_mode, random_state)
         else:
             silhouette_coef = -1
     except Exception as e:
@@ -248,59 +410,651 @@ def meanshift_clustering(selected_features, mode, quantile=0.3, n_samples=500):
     if mode == 1:
         return labels
     
+"""
+Performs MiniBatchKMeans clustering using the data from selected_features. Like
+kmeans_clustering it picks k in 2..5, but each fit streams over batches of the rows.
+If mode = 0, the silhouette score of the clustering is returned.
+If mode = 1, the labels of the clustering is returned.
+"""
+def minibatch_kmeans_clustering(selected_features, mode, batch_size=4096, max_iter=100, distances=None, warm_start=None,
+                                reward_mode=None, random_state=None):
+    # selected features are already standardized (see state_to_features)
+    X_scaled = selected_features
+
+    def fit(k):
+        init = warm_centroids(X_scaled, warm_start.get(k), k) if warm_start else None
+        if init is None:
+            model = MiniBatchKMeans(n_clusters=k, batch_size=batch_size, max_iter=max_iter, random_state=random_state)
+        else:
+            model = MiniBatchKMeans(n_clusters=k, batch_size=batch_size, max_iter=max_iter, init=init, n_init=1,
+                                    random_state=random_state)
+        return model.fit_predict(X_scaled)
+
+    silhouette_coef, labels = best_k_clustering(X_scaled, fit, range(2, 6), distances, warm_start, reward_mode, random_state)
+    if mode == 0:
+        return silhouette_coef, labels
+    if mode == 1:
+        return labels
+
+
+"""
+Performs Birch clustering using the data from selected_features. The CF-tree is
+built once in a single pass over the rows; the global clustering of its subclusters
+is redone for every k in 2..5.
+If mode = 0, the silhouette score of the clustering is returned.
+If mode = 1, the labels of the clustering is returned.
+"""
+def birch_clustering(selected_features, mode, threshold=0.5, distances=None, reward_mode=None, random_state=None):
+    # selected features are already standardized (see state_to_features)
+    X_scaled = selected_features
+    birch = Birch(threshold=threshold, n_clusters=None)
+
+    def fit(k):
+        if not hasattr(birch, "root_"):
+            birch.fit(X_scaled)
+        # partial_fit without data only redoes the global clustering step
+        birch.set_params(n_clusters=k)
+        birch.partial_fit()
+        return birch.predict(X_scaled)
+
+    silhouette_coef, labels = best_k_clustering(X_scaled, fit, range(2, 6), distances, reward_mode=reward_mode,
+                                                random_state=random_state)
+    if mode == 0:
+        return silhouette_coef, labels
+    if mode == 1:
+        return labels
+
+
+"""
+Performs HDBSCAN clustering using the data from selected_features. Noise points
+form a cluster of their own, like in dbscan_clustering.
+If mode = 0, the silhouette score of the clustering is returned.
+If mode = 1, the labels of the clustering is returned.
+"""
+def hdbscan_clustering(selected_features, mode, min_cluster_size=5, distances=None, reward_mode=None, random_state=None):
+    # selected features are already standardized (see state_to_features)
+    X_scaled = selected_features
+    labels = np.zeros(len(X_scaled), dtype=int) # single cluster if clustering fails
+    try:
+        labels = HDBSCAN(min_cluster_size=min_cluster_size).fit_predict(X_scaled)
+        if -1 in labels:
+            labels[labels == -1] = max(labels) + 1
+        silhouette_coef = score_labels(X_scaled, labels, distances, reward_mode, random_state)
+    except ValueError:
+        silhouette_coef = -1  # Assign lowest score if clustering fails (or finds a single cluster)
+    if mode == 0:
+        return silhouette_coef, labels
+    if mode == 1:
+        return labels
+
+
+# every clustering action run_rl can use, by name (the ADAS_RL_ACTIONS values):
+#   name       - shown in the results
+#   function   - called by algorithm_prep with the ALGORITHM_PARAMS of the action
+#   complexity - how the cost grows with the rows: linear, nlogn or quadratic. Actions
+#                whose class allows fewer rows than the data has are excluded (see run_rl).
+#                May depend on the config
+#   warm_start - takes the labels of a neighbouring mask (see warm_start_labels)
+#   graph      - takes the neighbour graph of the mask (see neighbourGraph)
+ACTION_REGISTRY = {
+    "dbscan": {"name": "DBSCAN Clustering", "function": dbscan_clustering, "complexity": "nlogn", "graph": True},
+    "meanshift": {"name": "Mean Shift", "function": meanshift_clustering, "complexity": "quadratic", "graph": True},
+    "kmedoids": {"name": "K-Mediods", "function": kmedoids_clustering, "warm_start": True,
+                 "complexity": lambda config: "quadratic" if config["kmedoids_mode"] == "full" else "linear"},
+    "em": {"name": "EM Clustering", "function": em_clustering, "complexity": "linear", "warm_start": True},
+    "kmeans": {"name": "K-Means", "function": kmeans_clustering, "complexity": "linear", "warm_start": True},
+    "minibatch_kmeans": {"name": "MiniBatch K-Means", "function": minibatch_kmeans_clustering, "complexity": "linear",
+                         "warm_start": True},
+    "birch": {"name": "Birch", "function": birch_clustering, "complexity": "linear"},
+    # sklearn's HDBSCAN grows much faster than n log n in practice (3.5s on 20k rows, 24s on 50k)
+    "hdbscan": {"name": "HDBSCAN", "function": hdbscan_clustering, "complexity": "quadratic"},
+}
+
+"""
+Returns the names of the actions in names that are feasible on n_rows rows under
+config (their complexity class allows that many rows and their library is
+installed), and the names that are not.
+"""
+def feasible_actions(names, n_rows, config):
+    limits = {"linear": None, "nlogn": config["max_rows_nlogn"], "quadratic": config["max_rows_quadratic"]}
+    feasible, excluded = [], []
+    for name in names:
+        complexity = ACTION_REGISTRY[name]["complexity"]
+        if callable(complexity):
+            complexity = complexity(config)
+        limit = limits[complexity]
+        if (limit is not None and n_rows > limit) or (name == "hdbscan" and HDBSCAN is None):
+            excluded.append(name)
+        else:
+            feasible.append(name)
+    return feasible, excluded
+
 ##### HELPER FUNCTIONS #####
 """
-Converts the binary value of state (which represents features selected) 
-to both list features and string output res. If mode = 0, returns features.
-If mode = 1, returns res.
-"""
-def bin_to_features(state, mode:int):
-  state_bin = bin(state)
-  #print(state_bin)
-  state_bin_arr = np.array([b for b in state_bin[2:]])
-  #pad with zeros
-  diff = len(FEATURES) - len(state_bin_arr)
-  padded_arr = np.insert(state_bin_arr, 0, ['0' for i in range(diff)])
-  (padded_arr)
-
-  # identify which indexes are 1
-  idx = (np.where(padded_arr == '1')[0]).tolist()
-  #print(idx)
-  # select feature headings
-  selected_features = OG_FEATURES.iloc[:,idx]
-  features = selected_features.columns.tolist()
-  res = f"Features Used: {features}"
-  if mode == 0: # return the dataframe of selected features
-    return selected_features
-  if mode == 1: # return the actual feature headings list
-    return features
-  
-
-def algorithm_prep(state, action, mode):
-  selected_features = bin_to_features(state, 0)
-  
-  # call algorithm function
-  out = None
-  #print('algorithm:',ALGORITHMS[action])
-
-  # if mode = 0, output is the silhouette coefficient
-  # if mode = 1, output is the cluster labelling
-  match action:   
-    case 0:
-      #print('algorithm:',ALGORITHMS[action])
-      out = dbscan_clustering(selected_features, mode)
-    case 1: 
-      #print('algorithm:',ALGORITHMS[action])
-      out = meanshift_clustering(selected_features, mode)
-    case 2:
-      #print('algorithm:',ALGORITHMS[action])
-      out = kmedoids_clustering(selected_features, mode)
-    case 3: 
-      out = em_clustering(selected_features, mode)
-    case 4:
-      out = kmeans_clustering(selected_features, mode)
-  return out
-    
+Fits fit(k) for every k in k_options (numbers of clusters, or DBSCAN eps values) and
+returns the score and labels of the best clustering (the first k on ties). A k whose fit fails or whose labels cannot be scored
+is skipped; if all of them are, the score is -1 with a single cluster.
+If warm_start is given, the labels of every k are stored in it for the next evaluation.
+The clusterings are scored with reward_mode (see score_labels).
+"""
+def best_k_clustering(X_scaled, fit, k_options, distances=None, warm_start=None, reward_mode=None, random_state=None):
+  best_score, best_labels = -1, np.zeros(len(X_scaled), dtype=int)
+  found = False
+  for k in k_options:
+    try:
+      labels = fit(k)
+    except Exception:
+      continue
+    if warm_start is not None:
+      warm_start[k] = compact_labels(labels)
+    try:
+      score = score_labels(X_scaled, labels, distances, reward_mode, random_state)
+    except ValueError:
+      continue
+    if not found or score > best_score:
+      best_score, best_labels, found = score, labels, True
+  return best_score, best_labels
+
+"""
+Fits GaussianMixture restarts of n_components on X one at a time and returns the one
+with the best log-likelihood, like GaussianMixture(n_init=max_init). Restarting stops
+early once agree restarts reached the best log-likelihood (within tol), as further
+restarts rarely beat it. The first restart starts from means_init if given. The
+restarts draw their initializations from random_state in turn.
+"""
+def fit_em(X, n_components, covariance_type="full", max_init=10, agree=2, means_init=None, tol=1e-3, random_state=None):
+  best, agreeing = None, 0
+  random_state = check_random_state(random_state)
+  for restart in range(max(1, max_init)):
+    model = GaussianMixture(n_components=n_components, covariance_type=covariance_type,
+                            means_init=means_init if restart == 0 else None, random_state=random_state)
+    try:
+      model.fit(X)
+    except ValueError: # e.g. ill-defined covariance of a restart
+      continue
+    if best is None or model.lower_bound_ > best.lower_bound_ + tol:
+      best, agreeing = model, 1
+    elif model.lower_bound_ >= best.lower_bound_ - tol:
+      agreeing += 1
+      if model.lower_bound_ > best.lower_bound_:
+        best = model
+    if agree > 0 and agreeing >= agree:
+      break
+  if best is None:
+    raise ValueError(f"No EM restart of {n_components} components converged")
+  return best
+
+"""
+Returns the centroids in X of the k clusters of labels (the labels of a neighbouring
+mask), or None if there are no labels or they do not have k clusters.
+"""
+def warm_centroids(X, labels, k):
+  if labels is None:
+    return None
+  clusters, inverse = np.unique(labels, return_inverse=True)
+  if len(clusters) != k:
+    return None
+  onehot = np.zeros((k, len(X)))
+  onehot[inverse, np.arange(len(X))] = 1
+  return (onehot @ X) / np.bincount(inverse)[:, None]
+
+"""
+Returns the row indexes in X of the medoids of the k clusters of labels: the point with
+the smallest distance sum to its cluster when the distance matrix is given, the point
+closest to the cluster centroid otherwise. None if there are no labels or not k clusters.
+"""
+def warm_medoids(X, labels, k, distances=None):
+  centroids = warm_centroids(X, labels, k)
+  if centroids is None:
+    return None
+  inverse = np.unique(labels, return_inverse=True)[1]
+  medoids = []
+  for c in range(k):
+    members = np.flatnonzero(inverse == c)
+    if distances is not None:
+      medoids.append(members[np.argmin(distances[np.ix_(members, members)].sum(axis=1))])
+    else:
+      medoids.append(members[np.argmin(((X[members] - centroids[c]) ** 2).sum(axis=1))])
+  return np.array(medoids)
+
+"""
+Scores the clustering labels of X with reward_mode (a dict of the mode and sample size
+of rewardMetrics.cluster_score, exact silhouette by default). Stands in for
+silhouette_score everywhere in this module (raises ValueError the same way).
+"""
+def score_labels(X, labels, distances=None, reward_mode=None, random_state=None):
+  reward_mode = reward_mode or DEFAULT_REWARD_MODE
+  return cluster_score(X, labels, reward_mode["mode"], reward_mode["sample_size"], random_state=random_state,
+                       distances=distances)
+
+"""
+Turns the memory tracing of the evaluations on (on=True) or off for one run. Tracing
+is shared by the whole process, so it only stops when no run traces anymore.
+"""
+def trace_memory(on):
+  with MEMORY_TRACING["lock"]:
+    MEMORY_TRACING["runs"] += 1 if on else -1
+    if on and not tracemalloc.is_tracing():
+      tracemalloc.start()
+    elif not on and MEMORY_TRACING["runs"] == 0 and tracemalloc.is_tracing():
+      tracemalloc.stop()
+
+"""
+Returns the peak resident set size of this process in MB over its lifetime. Only used
+in the pool workers, which live for one run (see evaluate_in_worker).
+"""
+def lifetime_peak_rss_mb():
+    # ru_maxrss is in KB on Linux and in bytes on macOS
+    unit = 1 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * unit / 2**20
+
+class RssSampler:
+    """
+    Samples the resident set size of this process every interval seconds on a
+    background thread, between start and stop, and keeps the largest. The process is
+    shared by concurrent runs, so their memory counts too. Needs psutil.
+
+    Parameters:
+        interval: float, seconds between samples
+    """
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.peak = 0
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        if psutil is not None:
+            self.process = psutil.Process()
+            self.sample()
+            self.thread = threading.Thread(target=self.loop, daemon=True)
+            self.thread.start()
+        return self
+
+    def loop(self):
+        while not self.stopped.wait(self.interval):
+            self.sample()
+
+    def sample(self):
+        self.peak = max(self.peak, self.process.memory_info().rss)
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.sample()
+
+    def peak_mb(self):
+        """Returns the largest RSS sampled in MB, None without psutil."""
+        return round(self.peak / 2**20, 1) if self.thread is not None else None
+
+"""
+Returns the reward lost to the measured cost of an evaluation (a reward cache entry):
+time_weight * log10(1 + seconds / time_ref) plus the same for its memory, with the
+weights and references of cost (see RLEngine), so a clustering 10x slower than another
+loses about time_weight more. 0 when the weights are 0 or the cost was not measured.
+"""
+def cost_penalty(evaluation, cost):
+    penalty = 0.0
+    if cost["time_weight"] > 0 and evaluation.get("seconds") is not None:
+        penalty += cost["time_weight"] * np.log10(1 + evaluation["seconds"] / cost["time_ref"])
+    if cost["memory_weight"] > 0 and evaluation.get("memory_mb") is not None:
+        penalty += cost["memory_weight"] * np.log10(1 + evaluation["memory_mb"] / cost["memory_ref"])
+    return float(penalty)
+
+"""
+Returns the immediate reward of an evaluation (a reward cache entry): the normalized
+silhouette on the selected features, penalized when it is lower than the silhouette
+of the same labels on all features and by its cost (see cost_penalty, none if cost is
+None). Q-learning adds the discounted future reward to it. An evaluation that timed
+out gets the timeout reward.
+"""
+def immediate_reward(evaluation, cost=None):
+    if evaluation.get("timed_out"):
+        return evaluation["reward"]
+    selected_silhouette_co = evaluation["selected"]
+    overall_silhouette_co = evaluation["overall"]
+
+    # calculate ratio of selected features
+    ratio = selected_silhouette_co / (overall_silhouette_co + 1e-6)
+    if selected_silhouette_co < overall_silhouette_co:
+        penalty = 0.1 * ratio
+    else: penalty = 0
+
+    # normalized silhouette score for better consistency in reinforcement learning
+    if selected_silhouette_co < 0: # ensures RL doesn't learn from bad clustering
+        norm_silhouette = 0
+    else:
+        norm_silhouette = (selected_silhouette_co + 1) / 2  # Scale from [-1,1] to [0,1]
+    return norm_silhouette - penalty - (cost_penalty(evaluation, cost) if cost else 0.0)
+
+"""
+Returns the stratum of every row of data for the subsample evaluations: the pair of
+its source IP and its time bucket (time_bins quantiles of epoch_time), using the
+columns that exist.
+"""
+def row_strata(data, source_ip, time_bins=8):
+    keys = []
+    if source_ip is not None and source_ip in data:
+        keys.append(data[source_ip])
+    if "epoch_time" in data:
+        keys.append(pd.qcut(data["epoch_time"], time_bins, labels=False, duplicates="drop"))
+    if not keys:
+        return np.zeros(len(data), dtype=int)
+    return data.groupby(keys, sort=False, dropna=False).ngroup().to_numpy()
+
+
+class RLEngine:
+    """
+    One feature/algorithm search over an uploaded dataset. The engine holds everything
+    the run needs (the data, the standardized features, the actions, the random
+    generators and the per-run caches), so several runs can go on side by side in one
+    process, e.g. in the threads of the server. Only the reward cache is shared.
+
+    With a seed the run is reproducible: the search draws from generators seeded with
+    it and every clustering from a seed derived from (seed, mask, algorithm, rows).
+    Budgets, timeouts and warm starts with n_workers > 1 (the workers see the pairs in
+    a varying order) make the result depend on timing again.
+
+    Parameters:
+        backend_data: dict with the "df", "features" and "source_ip" of the upload
+        options: dict, overrides of RL_CONFIG for this run
+    """
+
+    def __init__(self, backend_data, options=None):
+        config = self.config = {**RL_CONFIG, **(options or {})}
+        features = backend_data["features"]
+        print("Selected features:", features)
+        if config["reward_mode"] not in REWARD_MODES:
+            raise ValueError(f"Unknown reward mode {config['reward_mode']!r}, expected one of {REWARD_MODES}")
+        if config["strategy"] != "qlearning" and config["strategy"] not in SEARCH_STRATEGIES:
+            raise ValueError(f"Unknown search strategy {config['strategy']!r}, expected qlearning or one of {tuple(SEARCH_STRATEGIES)}")
+        if config["kmedoids_mode"] not in ("auto", "full", "clara"):
+            raise ValueError(f"Unknown k-medoids mode {config['kmedoids_mode']!r}, expected auto, full or clara")
+        if config["em_covariance"] not in ("full", "tied", "diag", "spherical"):
+            raise ValueError(f"Unknown EM covariance {config['em_covariance']!r}, expected full, tied, diag or spherical")
+        if config["cost_time_ref"] <= 0 or config["cost_memory_ref"] <= 0:
+            raise ValueError("cost_time_ref and cost_memory_ref must be positive")
+        eps = config["dbscan_eps"]
+        eps_sweep = config["dbscan_eps_sweep"]
+        if isinstance(eps_sweep, str):
+            eps_sweep = eps_sweep.split(",")
+        # per-run algorithm settings, merged into ALGORITHM_PARAMS (see algorithm_params)
+        self.run_params = {"dbscan": {"eps": eps if eps == "auto" else float(eps), "eps_sweep": tuple(float(f) for f in eps_sweep)},
+                           "em": {"covariance_type": config["em_covariance"], "max_init": config["em_max_init"], "agree": config["em_agree"],
+                                  "components": tuple(range(2, 6)) if config["em_components"] == "bic" else None,
+                                  "n_clusters": 2 if config["em_components"] == "bic" else int(config["em_components"])},
+                           "kmedoids": {"method": config["kmedoids_mode"], "clara_rows": config["clara_rows"],
+                                        "clara_draws": config["clara_draws"], "clara_sample_size": config["clara_sample_size"]}}
+        # how clusterings are scored (see rewardMetrics.cluster_score)
+        self.reward_mode = {"mode": config["reward_mode"], "sample_size": config["reward_sample_size"]}
+        # weights of the measured cost of a clustering in its reward (see cost_penalty)
+        self.cost = {"time_weight": config["cost_time_weight"], "memory_weight": config["cost_memory_weight"],
+                     "time_ref": config["cost_time_ref"], "memory_ref": config["cost_memory_ref"],
+                     "track_memory": config["cost_track_memory"]}
+        self.track_memory = self.cost["track_memory"] or self.cost["memory_weight"] > 0
+        # generators of the search (the clusterings get their own seeds, see evaluation_seed)
+        self.seed = None if config["seed"] is None else int(config["seed"])
+        self.rng = np.random.default_rng(self.seed)
+        self.random = random.Random(self.seed)
+
+        self.features = {k:str(v) for k,v in zip(range(len(features)), features) }
+        self.data = backend_data["df"]
+        # the actions of this run, without the ones too costly for the number of rows.
+        # an action is an index in self.actions (names of ACTION_REGISTRY)
+        names = config["actions"].split(",") if isinstance(config["actions"], str) else list(config["actions"])
+        unknown = [name for name in names if name not in ACTION_REGISTRY]
+        if unknown:
+            raise ValueError(f"Unknown actions {unknown}, expected some of {tuple(ACTION_REGISTRY)}")
+        self.actions, self.excluded_actions = feasible_actions(names, len(self.data), config)
+        if not self.actions:
+            raise ValueError(f"No action is feasible on {len(self.data)} rows, excluded: {self.excluded_actions}")
+        if self.excluded_actions:
+            print(f"Actions excluded on {len(self.data)} rows:", self.excluded_actions)
+        self.algorithms = {i: ACTION_REGISTRY[name]["name"] for i, name in enumerate(self.actions)}
+        self.num_alg = len(self.algorithms)
+        self.og_features = self.data[features].copy(deep = True)
+        self.fingerprint = dataset_fingerprint(self.og_features)
+
+        # standardized once; every evaluation takes its columns from this matrix
+        scaler = StandardScaler()
+        self.scaled = np.ascontiguousarray(scaler.fit_transform(self.og_features), dtype=np.float64)
+        # order of the rows stratified by source IP and time; lower fidelity evaluations use its
+        # first n_rows rows. fixed seed, so reruns on the same data reuse the cached subsample evaluations
+        self.row_order = fidelity_order(row_strata(self.data, backend_data["source_ip"]), np.random.default_rng(0))
+        # n_rows -> digest of the rows of the evaluations on n_rows rows (see cache_key)
+        self.row_digests = {}
+        # labels of the last KMeans/KMedoids/EM evaluations for warm starts (see warm_start_labels), None if disabled
+        self.warm_start = {} if config["warm_start"] else None
+        # nearest-neighbour graphs of the last feature masks, shared by DBSCAN and MeanShift (see neighbourGraph)
+        self.neighbour_graphs = NeighbourGraphCache(config["neighbour_cache_masks"])
+
+        # incremental pairwise distances of the feature masks (see distanceEngine). only worth it (and only
+        # affordable) for small/medium datasets: memory is ~(F + 9) * n^2 * 4 bytes, plus one matrix per
+        # cached neighbour graph
+        self.dist_engine = None
+        if DistanceEngine.memory_needed(*self.scaled.shape, cache_masks=8 + config["neighbour_cache_masks"]) <= config["distance_cache_mb"] * 2**20:
+            self.dist_engine = DistanceEngine(self.scaled)
+        # distances of the full feature space for the exact overall silhouette, computed by run
+        self.full_silhouette = None
+
+    def __getstate__(self):
+        # sent to the worker processes when they are spawned: the caches are rebuilt there
+        # and the memory-mapped full-feature distances are reopened by path
+        state = self.__dict__.copy()
+        state.update(data=None, og_features=None, neighbour_graphs=None, dist_engine=self.dist_engine is not None,
+                     full_silhouette=self.full_silhouette.path if self.full_silhouette is not None else None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.warm_start = {} if self.warm_start is not None else None
+        self.neighbour_graphs = NeighbourGraphCache(self.config["neighbour_cache_masks"])
+        self.dist_engine = DistanceEngine(self.scaled) if self.dist_engine else None
+        if self.full_silhouette is not None:
+            self.full_silhouette = FullSilhouette.open(self.full_silhouette, len(self.scaled))
+
+    def warm_start_labels(self, state, action, rows):
+        """
+        Returns the dict of k -> labels a KMeans/KMedoids/EM (any warm_start action) evaluation of (state, action) starts
+        from: the labels of the last evaluation of the same algorithm on the same rows if its
+        mask differs from state by at most 2 features, otherwise an empty dict. The evaluation
+        fills it with its own labels for the next one. None if warm starts are disabled.
+        """
+        if self.warm_start is None or not ACTION_REGISTRY[self.actions[action]].get("warm_start"):
+            return None
+        key = (action, None if rows is None else len(rows))
+        previous = self.warm_start.get(key)
+        labels = {}
+        if previous is not None and (previous[0] ^ state).bit_count() <= 2:
+            labels = dict(previous[1])
+        self.warm_start[key] = (state, labels)
+        return labels
+
+    def algorithm_params(self, action):
+        """Returns the parameters algorithm_prep passes to the algorithm of action."""
+        name = self.actions[action]
+        return {**ALGORITHM_PARAMS[name], **self.run_params.get(name, {})}
+
+    def evaluation_seed(self, state, action, n_rows=None):
+        """Returns the seed of the clustering of (state, action) on n_rows rows, None if the run has no seed."""
+        if self.seed is None:
+            return None
+        entropy = [self.seed, state, zlib.crc32(self.actions[action].encode()), n_rows or 0]
+        return int(np.random.SeedSequence(entropy).generate_state(1)[0])
+
+    def cache_key(self, state, action, n_rows=None):
+        """
+        Returns the reward cache key of the (state, action) pair for the data and reward mode of the run,
+        evaluated on the first n_rows rows of row_order (all rows if n_rows is None). The key of a
+        subsample holds a digest of its rows, since row_order depends on the source IP and time
+        columns, which the fingerprint of the features does not cover.
+        """
+        params = {**self.algorithm_params(action), **self.reward_mode}
+        if n_rows is not None:
+            params["n_rows"] = n_rows
+            if n_rows not in self.row_digests:
+                rows = np.sort(self.row_order[:n_rows]).astype(np.int64)
+                self.row_digests[n_rows] = hashlib.sha1(rows.tobytes()).hexdigest()
+            params["rows"] = self.row_digests[n_rows]
+        if self.seed is not None:
+            params["seed"] = self.seed
+        return REWARD_CACHE.make_key(self.fingerprint, state, self.actions[action], params)
+
+    def fidelity_rows(self, n_rows):
+        """Returns the (sorted) indexes of the rows of an evaluation on n_rows rows, or None for all rows."""
+        if n_rows is None or n_rows >= len(self.row_order):
+            return None
+        return np.sort(self.row_order[:n_rows])
+
+    def state_to_idx(self, state):
+        """
+        Returns the column indexes of the features selected by state. The most significant
+        of the len(features) bits is the first feature.
+        """
+        num_features = len(self.features)
+        return [i for i in range(num_features) if (state >> (num_features - 1 - i)) & 1]
+
+    def state_to_features(self, state):
+        """
+        Returns the standardized values of the features selected by state, taken from the
+        matrix standardized once (standardizing a subset of columns gives the same
+        values as taking the subset of the standardized columns). No copy is made if all
+        features are selected.
+        """
+        idx = self.state_to_idx(state)
+        if len(idx) == self.scaled.shape[1]:
+            return self.scaled
+        return self.scaled[:, idx]
+
+    def bin_to_features(self, state, mode:int):
+        """
+        Converts the binary value of state (which represents features selected)
+        to both list features and string output res. If mode = 0, returns features.
+        If mode = 1, returns res.
+        """
+        # identify which indexes are 1
+        idx = self.state_to_idx(state)
+        # select feature headings
+        selected_features = self.og_features.iloc[:,idx]
+        features = selected_features.columns.tolist()
+        res = f"Features Used: {features}"
+        if mode == 0: # return the dataframe of selected features
+            return selected_features
+        if mode == 1: # return the actual feature headings list
+            return features
+
+    def algorithm_prep(self, state, action, mode, rows=None):
+        selected_features = self.state_to_features(state)
+        # pairwise distances of the selected features, derived incrementally from earlier masks
+        distances = None
+        if self.dist_engine is not None:
+            distances = self.dist_engine.distances(self.state_to_idx(state))
+        # lower fidelity evaluation on a subset of the rows
+        if rows is not None:
+            selected_features = selected_features[rows]
+            if distances is not None:
+                distances = distances[np.ix_(rows, rows)]
+
+        # call algorithm function
+        spec = ACTION_REGISTRY[self.actions[action]]
+
+        # if mode = 0, output is the silhouette coefficient
+        # if mode = 1, output is the cluster labelling
+        params = self.algorithm_params(action)
+        if spec.get("warm_start"):
+            params["warm_start"] = self.warm_start_labels(state, action, rows)
+        # nearest-neighbour index, k-distances and radius graph of the mask, shared by DBSCAN and MeanShift
+        if spec.get("graph"):
+            params["graph"] = self.neighbour_graphs.get((state, None if rows is None else len(rows)), selected_features, distances)
+        return spec["function"](selected_features, mode, distances=distances, reward_mode=self.reward_mode,
+                                random_state=self.evaluation_seed(state, action, None if rows is None else len(rows)),
+                                **params)
+
+    def evaluate_pair(self, state, action, n_rows=None):
+        """
+        Runs the algorithm of action on the features of state and returns the silhouette
+        score on the selected features, the silhouette score of the same labels on all
+        features, the (compact) cluster labels, the seconds the clustering and its scoring
+        took and the peak MB they allocated (through Python and numpy, None unless memory is
+        tracked; concurrent runs of one process share the peak). Runs in the worker
+        processes as well. If n_rows is given, only the first n_rows rows of row_order are clustered.
+        """
+        rows = self.fidelity_rows(n_rows)
+        if self.track_memory:
+            if not tracemalloc.is_tracing(): # a worker process
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        selected_silhouette_co, labels = self.algorithm_prep(state, action, 0, rows)
+        seconds = time.perf_counter() - start
+        memory_mb = max(0.0, tracemalloc.get_traced_memory()[1] - base) / 2**20 if self.track_memory else None
+        try:
+            if self.full_silhouette is not None and self.reward_mode["mode"] == "exact":
+                # reuses the full-feature distances
+                if rows is None:
+                    overall_silhouette_co = self.full_silhouette.score(labels)
+                else:
+                    overall_silhouette_co = silhouette_from_distances(self.full_silhouette.distances[np.ix_(rows, rows)], np.asarray(labels))
+            else:
+                overall_silhouette_co = score_labels(self.scaled if rows is None else self.scaled[rows], labels,
+                                                     reward_mode=self.reward_mode, random_state=self.evaluation_seed(state, action, n_rows))
+        except ValueError: overall_silhouette_co = -1
+        return selected_silhouette_co, overall_silhouette_co, compact_labels(labels), seconds, memory_mb
+
+    def reward(self, evaluation):
+        """Returns the immediate reward of evaluation with the cost weights of the run."""
+        return immediate_reward(evaluation, self.cost)
+
+    def run(self):
+        """
+        Runs the search and returns the anomalies, the cluster sizes, the final features
+        and the run statistics (see RL).
+        """
+        config = self.config
+        # the overall silhouette is always computed on the full feature space, so its distances
+        # are computed once: kept in RAM, or memory-mapped to a file when too big for RAM or shared
+        # with worker processes. files are only written if the deployment allows it (silhouette_disk_mb)
+        needed = FullSilhouette.disk_needed(len(self.scaled))
+        shared = config["n_workers"] > 1 or config["eval_timeout"] > 0
+        in_memory = not shared and needed <= config["silhouette_cache_mb"] * 2**20
+        if self.reward_mode["mode"] == "exact" and (in_memory or needed <= config["silhouette_disk_mb"] * 2**20):
+            self.full_silhouette = FullSilhouette(self.scaled,
+                                                  max_memory_bytes=config["silhouette_cache_mb"] * 2**20,
+                                                  mmap_dir=config["silhouette_mmap_dir"],
+                                                  force_mmap=not in_memory)
+        # tracing slows every allocation down, so it is only on during the search
+        if self.track_memory:
+            trace_memory(True)
+        try:
+            anomalies, cluster_sizes, final_features, run_info = RL(self)
+            run_info["excluded_actions"] = self.excluded_actions
+        finally:
+            if self.full_silhouette is not None:
+                self.full_silhouette.close()
+                self.full_silhouette = None
+            if self.track_memory:
+                trace_memory(False)
+        return anomalies, cluster_sizes, final_features, run_info
+
+"""
+Initializer of the RL worker processes: keeps the engine of the run whose pool they
+belong to for evaluate_in_worker.
+"""
+def init_worker(engine):
+    global WORKER_ENGINE
+    WORKER_ENGINE = engine
+
+"""
+Runs RLEngine.evaluate_pair in a worker process. Returns its result and the peak RSS
+of the worker (in MB) so far, which is the peak during the run since every run starts
+its own pool.
+"""
+def evaluate_in_worker(state, action, n_rows=None):
+    return WORKER_ENGINE.evaluate_pair(state, action, n_rows), lifetime_peak_rss_mb()
+
 
 ##### REINFORCEMENT LEARNING #####
 # Markov Decision Process (MDP) - The Bellman equations adapted to
@@ -308,19 +1062,286 @@ def algorithm_prep(state, action, mode):
 # Copyright 2018 Denis Rothman MIT License. See LICENSE.
 import numpy as ql
 
-def RL(data, original_features_scaled):
+class PairEvaluator:
+    """
+    Evaluates (state, action) pairs for the searches (Q-learning and searchStrategies):
+    looks them up in the reward cache, clusters the missing ones (concurrently on a
+    worker pool if n_workers > 1) and keeps track of the max_evals and time_budget budgets.
+    With fidelity_rows set, evaluate_multifidelity scores pairs on a subsample of the
+    rows first and only promotes the promising ones to larger subsamples.
+    With eval_timeout set, every clustering runs in a worker process that is killed
+    when it runs longer than eval_timeout seconds.
+
+    Parameters:
+        engine: RLEngine of the run
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.config = config = engine.config
+        # generator of the searches (see searchStrategies)
+        self.random = engine.random
+        self.n_rows = len(engine.scaled)
+        self.num_evals = 0
+        self.start_time = time.monotonic()
+        self.n_workers = max(1, config["n_workers"])
+        # number of fits, their total and largest seconds and memory per action
+        self.fit_stats = {}
+        # entries of the pairs that timed out (by cache key), not retried during the run
+        self.timed_out = {}
+        self.pool_restarts = 0
+        # largest peak RSS (MB) reported by a worker process
+        self.worker_peak_mb = None
+        self.pool = None
+        if self.n_workers > 1 or config["eval_timeout"] > 0:
+            self.pool = self.start_pool()
+        # rows of every fidelity: fidelity_rows, times fidelity_eta, ..., all rows (None)
+        self.eta = max(2, config["fidelity_eta"])
+        self.rungs = []
+        rows = config["fidelity_rows"]
+        while 0 < rows < self.n_rows:
+            self.rungs.append(rows)
+            rows *= self.eta
+        self.rungs.append(None)
+        # immediate reward of every pair evaluated at each fidelity
+        self.rung_rewards = [{} for _ in self.rungs]
+
+    def start_pool(self):
+        return multiprocessing.Pool(processes=self.n_workers, initializer=init_worker, initargs=(self.engine,))
+
+    def evaluate(self, pairs, n_rows=None):
+        """
+        Returns the reward cache entry of every pair, evaluated on the first n_rows rows
+        of the engine's row_order (all rows if None). Pairs beyond the max_evals budget, or left
+        when the time budget runs out, are not evaluated (their entry is None).
+        """
+        if n_rows is not None and n_rows >= self.n_rows:
+            n_rows = None
+        keys = [self.engine.cache_key(s, a, n_rows) for s, a in pairs]
+        evaluations = [self.timed_out.get(key) or REWARD_CACHE.get(key) for key in keys]
+        todo = [j for j, evaluation in enumerate(evaluations) if evaluation is None]
+        if self.config["max_evals"] > 0:
+            todo = todo[:max(0, self.config["max_evals"] - self.num_evals)]
+        # with a time budget the deadline is checked before every n_workers clusterings, so a long
+        # list of pairs (e.g. a level of the greedy or beam search) cannot overrun it. the first
+        # clusterings of the run always run, so there is a configuration to return
+        batch_size = self.n_workers if self.config["time_budget"] > 0 else max(1, len(todo))
+        for start in range(0, len(todo), batch_size):
+            if self.num_evals > 0 and self.config["time_budget"] > 0 and self.elapsed() >= self.config["time_budget"]:
+                break
+            batch = todo[start:start + batch_size]
+            self.num_evals += len(batch)
+            for j, evaluation in zip(batch, self.compute([pairs[j] for j in batch], [keys[j] for j in batch], n_rows)):
+                evaluations[j] = evaluation
+        return evaluations
+
+    def evaluate_full(self, pair):
+        """
+        Returns the reward cache entry of pair evaluated on all rows, clustering it if
+        needed (regardless of the budgets).
+        """
+        key = self.engine.cache_key(*pair)
+        evaluation = self.timed_out.get(key) or REWARD_CACHE.get(key)
+        if evaluation is None:
+            evaluation = self.compute([pair], [key], None)[0]
+        return evaluation
+
+    def compute(self, pairs, keys, n_rows):
+        """
+        Clusters pairs on the first n_rows rows of the engine's row_order and returns their entries,
+        stored in the reward cache under keys. The entry of a pair that timed out has the
+        timeout_reward and no labels, and is not cached.
+        """
+        args = [(state, action, n_rows) for state, action in pairs]
+        if self.config["eval_timeout"] > 0:
+            results = [self.worker_result(report) for report in self.run_with_timeout(args)]
+        elif self.pool is not None and len(args) > 1:
+            results = [self.worker_result(report) for report in self.pool.starmap(evaluate_in_worker, args)]
+        else:
+            results = [self.engine.evaluate_pair(*arg) for arg in args]
+        evaluations = []
+        for (state, action), key, result in zip(pairs, keys, results):
+            if result is None:
+                evaluation = self.timed_out[key] = {"selected": -1.0, "overall": -1.0, "labels": None,
+                                                    "seconds": self.config["eval_timeout"], "memory_mb": None,
+                                                    "timed_out": True, "reward": self.config["timeout_reward"]}
+                self.record_fit(action, None)
+            else:
+                selected, overall, labels, seconds, memory_mb = result
+                evaluation = REWARD_CACHE.put(key, selected, overall, labels, seconds, memory_mb)
+                self.record_fit(action, seconds, memory_mb)
+            evaluations.append(evaluation)
+        return evaluations
+
+    def worker_result(self, report):
+        """Returns the result of evaluate_in_worker's report (None if timed out), recording the worker's peak RSS."""
+        if report is None:
+            return None
+        result, peak_mb = report
+        self.worker_peak_mb = max(self.worker_peak_mb or 0.0, peak_mb)
+        return result
+
+    def run_with_timeout(self, args):
+        """
+        Runs evaluate_in_worker on every tuple of args in the worker pool, at most n_workers at
+        a time, and returns the reports (None for the ones that ran longer than
+        eval_timeout seconds). A pool worker cannot be stopped on its own, so on a timeout
+        the whole pool is replaced and the other evaluations still running start over.
+        """
+        timeout = self.config["eval_timeout"]
+        results = [None] * len(args)
+        pending = list(range(len(args)))
+        running = {} # index in args -> (async result, deadline)
+        done = queue.Queue()
+        while pending or running:
+            while pending and len(running) < self.n_workers:
+                i = pending.pop(0)
+                notify = lambda _, i=i, done=done: done.put(i)
+                running[i] = (self.pool.apply_async(evaluate_in_worker, args[i], callback=notify, error_callback=notify),
+                              time.monotonic() + timeout)
+            deadline = min(deadline for _, deadline in running.values())
+            # finished evaluations are only taken from the queue: the callback runs before the
+            # result is marked ready, so polling ready() as well could take one twice
+            try:
+                i = done.get(timeout=max(0.0, deadline - time.monotonic()))
+                results[i] = running.pop(i)[0].get() # waits for ready(), raises the error of a failed evaluation
+                continue
+            except queue.Empty:
+                pass
+            now = time.monotonic()
+            expired = [i for i, (_, deadline) in running.items() if deadline <= now]
+            if not expired:
+                continue
+            for i in expired:
+                del running[i]
+                state, action, n_rows = args[i]
+                logging.warning("Clustering %s on features %s (%s rows) timed out after %ss", self.engine.algorithms[action],
+                                self.engine.bin_to_features(state, 1), n_rows or self.n_rows, timeout)
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = self.start_pool()
+            self.pool_restarts += 1
+            pending[:0] = list(running)
+            running.clear()
+            done = queue.Queue() # the callbacks of the old pool may still fire
+        return results
+
+    def record_fit(self, action, seconds, memory_mb=None):
+        """Records the cost of one fit of action (seconds None: the fit timed out)."""
+        stats = self.fit_stats.setdefault(action, {"fits": 0, "seconds": 0.0, "max_seconds": 0.0, "timeouts": 0,
+                                                   "memory_fits": 0, "memory_mb": 0.0, "max_memory_mb": 0.0})
+        if seconds is None:
+            stats["timeouts"] += 1
+            return
+        stats["fits"] += 1
+        stats["seconds"] += seconds
+        stats["max_seconds"] = max(stats["max_seconds"], seconds)
+        if memory_mb is not None:
+            stats["memory_fits"] += 1
+            stats["memory_mb"] += memory_mb
+            stats["max_memory_mb"] = max(stats["max_memory_mb"], memory_mb)
+
+    def algorithm_costs(self):
+        """
+        Returns the number of fits, their mean and largest seconds, (if tracked) their
+        mean and largest peak MB and the number of timeouts per algorithm. Subsample fits
+        are included.
+        """
+        costs = {}
+        for action, stats in sorted(self.fit_stats.items()):
+            cost = {"fits": stats["fits"], "mean_seconds": round(stats["seconds"] / max(1, stats["fits"]), 4),
+                    "max_seconds": round(stats["max_seconds"], 4), "timeouts": stats["timeouts"]}
+            if stats["memory_fits"]:
+                cost["mean_memory_mb"] = round(stats["memory_mb"] / stats["memory_fits"], 2)
+                cost["max_memory_mb"] = round(stats["max_memory_mb"], 2)
+            costs[self.engine.algorithms[action]] = cost
+        return costs
+
+    def evaluate_multifidelity(self, pairs):
+        """
+        Returns the entry of every pair at the highest fidelity it reached. Pairs start
+        at the lowest fidelity and are promoted to the next one while their reward is
+        in the top 1 / eta of the rewards seen at their fidelity (asynchronous successive
+        halving). Same as evaluate(pairs) when multi-fidelity is off.
+        """
+        evaluations = self.evaluate(pairs, self.rungs[0])
+        current = [j for j, evaluation in enumerate(evaluations) if evaluation is not None]
+        for level in range(1, len(self.rungs)):
+            rewards = self.rung_rewards[level - 1]
+            for j in current:
+                rewards[pairs[j]] = self.engine.reward(evaluations[j])
+            if len(rewards) < self.eta: # too few rewards to tell the promising pairs apart
+                break
+            threshold = np.quantile(list(rewards.values()), 1 - 1 / self.eta)
+            current = [j for j in current if rewards[pairs[j]] >= threshold]
+            promoted = []
+            for j, evaluation in zip(current, self.evaluate([pairs[j] for j in current], self.rungs[level])):
+                if evaluation is not None:
+                    evaluations[j] = evaluation
+                    promoted.append(j)
+            current = promoted
+            if not current:
+                break
+        else:
+            for j in current:
+                self.rung_rewards[-1][pairs[j]] = self.engine.reward(evaluations[j])
+        return evaluations
+
+    def score(self, pairs, n_rows=None):
+        """
+        Returns the immediate reward of every pair (None for pairs that were not evaluated),
+        on the first n_rows rows of the engine's row_order if given and with multi-fidelity otherwise.
+        """
+        evaluations = self.evaluate(pairs, n_rows) if n_rows is not None else self.evaluate_multifidelity(pairs)
+        return [None if evaluation is None else self.engine.reward(evaluation) for evaluation in evaluations]
+
+    def multifidelity(self):
+        return len(self.rungs) > 1
+
+    def fidelity_stats(self):
+        """Returns the number of pairs evaluated at each fidelity (by number of rows)."""
+        return {str(rows or self.n_rows): len(rewards) for rows, rewards in zip(self.rungs, self.rung_rewards)}
+
+    def elapsed(self):
+        return time.monotonic() - self.start_time
+
+    def exhausted(self):
+        """Returns the name of the first exhausted budget, or None."""
+        if self.config["time_budget"] > 0 and self.elapsed() >= self.config["time_budget"]:
+            return "time_budget"
+        if self.config["max_evals"] > 0 and self.num_evals >= self.config["max_evals"]:
+            return "max_evals"
+        return None
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+
+
+"""
+The epsilon-greedy Q-learning search. Returns the best (state, action) pair and a
+dict with the number of iterations, the stop reason, the labels of the best pair
+(None if they were not kept) and, with multi-fidelity, the candidates to refit on all rows.
+"""
+def q_learning(evaluator, config):
+    engine = evaluator.engine
+    # the run's generators, so a seeded run picks the same pairs every time
+    rng, py_random = engine.rng, engine.random
+    num_alg = engine.num_alg
 
-    # R is The Reward Matrix for each state
     # 1024 configurations of the 10 features --> 2^10
     # 5 algorithms
-    num_configs = 2 ** len(FEATURES)
-    R = ql.matrix(ql.zeros([num_configs,NUM_ALG]))
+    num_configs = 2 ** len(engine.features)
 
-    # Q is the Learning Matrix in which rewards will be learned/stored
-    Q = ql.matrix(ql.zeros([num_configs,NUM_ALG]))
+    # Q is the Learning Matrix in which rewards will be learned/stored. It is sparse
+    # (only touched states are stored) so memory does not grow with 2^F
+    Q = SparseQTable(num_alg)
 
-    # used to save the labels of each (state, action) combination for later retrieval
-    cluster_labels_matrix = np.empty(Q.shape, dtype=object)
+    # used to save the labels of the best (state, action) combinations for later retrieval.
+    # labels of the other evaluated pairs are dropped to keep memory bounded
+    cluster_labels_matrix = TopLabelStore(config["label_top_k"])
 
     # Gamma : It's a form of penalty or uncertainty for learning
     # If the value is 1 , the rewards would be too high.
@@ -330,9 +1351,9 @@ def RL(data, original_features_scaled):
     # The possible "a" actions when the agent is in a given state
     def possible_actions(state):
         # 2) DONE: we should check Q, not R because R is never modified
-        current_state_row = Q[state,]
+        current_state_row = Q.row(state)
         # 3) DONE: this should pick valid actions based on what we have not visited
-        possible_act = ql.where(current_state_row == 0)[1]
+        possible_act = ql.flatnonzero(current_state_row == 0)
         return possible_act
 
 
@@ -342,15 +1363,15 @@ def RL(data, original_features_scaled):
     def ActionChoice(available_actions_range, state):
         epsilon = 0.95 # 90% exploration
         if len(available_actions_range) > 0:
-            if np.random.rand() < epsilon:  
+            if rng.random() < epsilon:
                 # Explore: Randomly pick from possible actions
-                next_action = int(ql.random.choice(available_actions_range, 1)[0])
+                next_action = int(rng.choice(available_actions_range))
             else:
                 # Exploit: Pick best action from Q matrix
-                next_action = int(np.argmax(Q[state, :]))
+                next_action = int(np.argmax(Q.row(state)))
         else:
         # If no valid actions, pick randomly from all possible algorithms
-            next_action = int(np.random.choice(NUM_ALG, 1)[0])
+            next_action = int(rng.integers(num_alg))
         
         return next_action
         
@@ -361,43 +1382,32 @@ def RL(data, original_features_scaled):
     # The transition function T from one state to another
     # is not in the equation below.  T is done by the random choice above
 
-    def reward(current_state, action, gamma):
-        Max_State = ql.where(Q[action,] == ql.max(Q[action,]))[1]
+    def reward(current_state, action, gamma, evaluation):
+        Max_State = ql.flatnonzero(Q.row(action) == ql.max(Q.row(action)))
 
         if Max_State.shape[0] > 1:
-            Max_State = int(ql.random.choice(Max_State, size = 1)[0])
+            Max_State = int(rng.choice(Max_State))
         else:
             Max_State = int(Max_State[0])
 
-        MaxValue = Q[Max_State, action]
-
-        # call function to run ML algorithm using the value of action. this will
-        # run the algorithm using the features from current_state, create clusters,
-        # and calculate the silhouette value.
-        selected_silhouette_co, labels = algorithm_prep(current_state, action, 0)
-        cluster_labels_matrix[current_state, action] = labels
-        try:
-            overall_silhouette_co = silhouette_score(original_features_scaled, labels)
-        except ValueError: overall_silhouette_co = -1
+        MaxValue = Q.get(Max_State, action)
 
-        # calculate ratio of selected features 
-        ratio = selected_silhouette_co / (overall_silhouette_co + 1e-6)
-        if selected_silhouette_co < overall_silhouette_co:
-            penalty = 0.1 * ratio
-        else: penalty = 0
-        
-        # Bellman's MDP based Q function
-
-        # normalized silhouette score for better consistency in reinforcement learning
-        if selected_silhouette_co < 0: # ensures RL doesn't learn from bad clustering
-            norm_silhouette = 0
-        else:
-            norm_silhouette = (selected_silhouette_co + 1) / 2  # Scale from [-1,1] to [0,1]
-        # norm_silhouette = (selected_silhouette_co + 1) / 2
-        
-        #norm_silhouette = (silhouette_co + 1) / 2  # Scale from [-1,1] to [0,1]
+        # Bellman's MDP based Q function, with the penalized normalized silhouette of
+        # the clustering of current_state with action as the immediate reward
         # Q[current_state, action] = norm_silhouette + gamma * MaxValue
-        Q[current_state, action] = (norm_silhouette - penalty) + gamma * MaxValue
+        Q.set(current_state, action, engine.reward(evaluation) + gamma * MaxValue)
+        value = Q.get(current_state, action)
+        # labels of subsample evaluations are not kept, timed out evaluations have none
+        if evaluation["labels"] is not None and len(evaluation["labels"]) == evaluator.n_rows:
+            cluster_labels_matrix.update((current_state, action), value, evaluation["labels"])
+
+        # keep track of the best configuration so far, so the search can stop at any time
+        nonlocal best_pair, best_value
+        if best_pair is None or value > best_value:
+            best_pair, best_value = (current_state, action), value
+        elif best_pair == (current_state, action) and value < best_value: # the best one got worse
+            best_pair = Q.argmax()
+            best_value = Q.get(*best_pair)
 
 
     # Learning over n iterations depending on the convergence of the system
@@ -423,51 +1433,84 @@ def RL(data, original_features_scaled):
 
 
     #state_epsilon = 0.95 # 5% exploration
-    visited_pairs = np.zeros(Q.shape, dtype=bool)
-    for a in range(NUM_ALG):
-        visited_pairs[0,a] = True # to skip all null feature configs
+    # all null feature configs (state 0) are skipped
+    visited_pairs = VisitedPairs(num_configs, num_alg)
 
     convergence_threshold = 0.01  
-    previous_Q = Q.copy()
-    iteration_buffer = num_configs * NUM_ALG
+    Q.mark() # the Q values are compared with the ones of the previous iteration
 
-    for i in range(10000):
-        print("Iteration:", i)
-        
+    # with batching, every iteration evaluates up to batch_size pairs (concurrently if
+    # n_workers > 1) and then applies their Q updates in the order they were picked
+    batch_size = max(1, config["batch_size"] or evaluator.n_workers)
+    iteration_buffer = num_configs * num_alg // batch_size
+
+    last_state = None
+    best_pair, best_value = None, None
+
+    # Picks the next (state, action) pair to evaluate and marks it as visited
+    def choose_pair(i):
+        nonlocal last_state
         # visit all states first, then allow full access to any state
-        unvisited_pairs = np.argwhere(visited_pairs == False)
+        has_unvisited = visited_pairs.has_unvisited()
         state_epsilon = max(0.1, 0.95 * (0.99 ** i)) # starts at 5% exploration/95% exploitation. exploration increases over time but is capped at 90%. 
 
-        if len(unvisited_pairs) > 0 and ql.random.rand() < state_epsilon:
-            current_pair = unvisited_pairs[ql.random.choice(len(unvisited_pairs))]
-            current_state, action = current_pair
+        if last_state is not None and rng.random() < state_epsilon * config["flip_bias"]:
+            # explore a neighbour of the last state (one feature added or removed), whose
+            # distance matrix the distance engine derives from the last one cheaply
+            current_state = last_state ^ (1 << py_random.randrange(len(engine.features)))
+            if current_state == 0:
+                current_state = last_state
+            action = ActionChoice(possible_actions(current_state), current_state)
+        elif has_unvisited and rng.random() < state_epsilon:
+            current_state, action = visited_pairs.random_unvisited(py_random)
         else:
-            if len(unvisited_pairs) == 0:
+            if not has_unvisited:
                 print('all pairs visited')
-            if ql.random.rand() < state_epsilon: # explore
-                current_state = ql.random.randint(1, int(Q.shape[0]))
+            k = 10
+            top_k_states = Q.top_states(k)
+            if rng.random() < state_epsilon or len(top_k_states) == 0: # explore
+                current_state = py_random.randrange(1, num_configs)
             else: # exploit past good states
-                k = 10
-                top_k_states = np.argsort(np.array(Q.sum(axis=1)).flatten())[-k:]
-                current_state = np.random.choice(top_k_states)
+                current_state = py_random.choice(top_k_states)
             PossibleAction = possible_actions(current_state)
             action = ActionChoice(PossibleAction, current_state)
-        visited_pairs[current_state, action] = True  
-        
+        visited_pairs.add(current_state, action)
+        last_state = current_state
+        return current_state, int(action)
+
+    # the search stops when Q converges or when the first budget runs out
+    stop_reason = "max_iterations"
+    for i in range(max(1, config["max_iterations"])):
+        print("Iteration:", i)
+
+        batch = []
+        for _ in range(batch_size):
+            pair = choose_pair(i)
+            if pair not in batch:
+                batch.append(pair)
+
         # print("Algorithm:", ALGORITHMS[action])
-        reward(current_state,action,gamma)
+        for (current_state, action), evaluation in zip(batch, evaluator.evaluate_multifidelity(batch)):
+            if evaluation is not None:
+                reward(current_state, action, gamma, evaluation)
         #visited_states.add((current_state, action))
 
         if i > iteration_buffer: # make sure it doesn't stop too early
         # check for convergence in Q to stop updates
-            Q_diff = np.abs(Q - previous_Q).sum()
+            Q_diff = Q.diff_since_mark()
             if Q_diff < convergence_threshold:
                 print(f"Converged at iteration {i} with Q_diff={Q_diff:.4f}")
+                stop_reason = "converged"
                 break
 
-        previous_Q = Q.copy() # update for comparison
+        Q.mark() # update for comparison
+
+        if best_pair is not None and evaluator.exhausted(): # always return a configuration, even on a tiny budget
+            stop_reason = evaluator.exhausted()
+            print(f"Stopped at iteration {i}: {stop_reason} exhausted, returning the best configuration so far")
+            break
         # 95% of the time, we choose the random action and state 
-        
+
     # Displaying Q before the norm of Q phase
     # print("Q:")
     # print(Q)
@@ -476,18 +1519,55 @@ def RL(data, original_features_scaled):
     # print("Normed Q:")
     # print(Q/ql.max(Q)*100)
 
-    # DONE: get maximum value from Q-Learning Matrix
-    normed_Q = Q/ql.max(Q)*100
-    max_location = np.where(normed_Q==normed_Q.max())
-    # print("\nmax value located at",max_location)
-    max_config = max_location[0][0]
-    max_algorithm = max_location[1][0]
-    final_feats = bin_to_features(max_config, 1) # force actual list output with mode=1
+    # DONE: get maximum value from Q-Learning Matrix (tracked during the search)
+    # with multi-fidelity the Q values mix rewards of different subsamples, so the final
+    # configuration is picked among the best pairs after refitting them on all rows
+    candidates = [best_pair]
+    if evaluator.multifidelity():
+        candidates += [pair for pair in Q.top_pairs(config["fidelity_confirm"]) if pair != best_pair]
+    return best_pair, {"iterations": i + 1, "stop_reason": stop_reason, "batch_size": batch_size,
+                       "labels": cluster_labels_matrix.get(best_pair), "candidates": candidates}
+
+
+"""
+Searches the best (feature configuration, algorithm) pair with config["strategy"]
+(Q-learning or one of searchStrategies.SEARCH_STRATEGIES) and flags the anomalous
+clusters of its clustering of the engine's data.
+"""
+def RL(engine):
+    config, data = engine.config, engine.data
+    cache_start = REWARD_CACHE.stats()
+    rss = RssSampler().start()
+    evaluator = PairEvaluator(engine)
+    try:
+        if config["strategy"] == "qlearning":
+            best_pair, search_info = q_learning(evaluator, config)
+        else:
+            best_pair, search_info = SEARCH_STRATEGIES[config["strategy"]](evaluator, len(engine.features), engine.num_alg, config)
+        if best_pair is None:
+            raise RuntimeError(f"The {config['strategy']} search did not evaluate any configuration")
+
+        # refit the candidates (best first) on all rows; with multi-fidelity the search only saw subsamples of most pairs
+        candidates = search_info.get("candidates") or [best_pair]
+        evaluations = [evaluator.evaluate_full(pair) for pair in candidates]
+    finally:
+        evaluator.close()
+        rss.stop()
+    # a refit that timed out has no labels, so only the finished ones can be picked (the first best on ties)
+    finished = [i for i, evaluation in enumerate(evaluations) if not evaluation.get("timed_out")]
+    if not finished:
+        raise RuntimeError(f"Every configuration refit on all rows timed out after {config['eval_timeout']}s")
+    best = max(finished, key=lambda i: engine.reward(evaluations[i]))
+    max_config, max_algorithm = candidates[best]
+    evaluation = evaluations[best]
+    final_feats = engine.bin_to_features(max_config, 1) # force actual list output with mode=1
     # print(f"\nUsing algorithm {ALGORITHMS[max_algorithm]} and {final_feats}, max value is:",normed_Q[max_config,max_algorithm])
     #DONE: print(f"Selected features:")
 
-    # get final cluster labels
-    cluster_labels = cluster_labels_matrix[max_config, max_algorithm]
+    # get final cluster labels (on all rows), the ones kept by the search or the ones of the refit
+    cluster_labels = search_info.get("labels") if best == 0 else None
+    if cluster_labels is None:
+        cluster_labels = evaluation["labels"]
 
     # match data to their clusters
     labelled_data = data.copy()
@@ -525,35 +1605,39 @@ def RL(data, original_features_scaled):
             anomalies = labelled_data[labelled_data['cluster'] == sorted_clusters.index[0]]
     
     cluster_sizes = labelled_data['cluster'].value_counts(normalize=True)
-    final_alg = ALGORITHMS[max_algorithm]
-
-    return anomalies, cluster_sizes, final_feats
+    final_alg = engine.algorithms[max_algorithm]
+
+    # run statistics for the caller (reward cache counters are for this run only)
+    cache_stats = REWARD_CACHE.stats()
+    run_cache = {k: cache_stats[k] - cache_start[k] for k in ("hits", "disk_hits", "misses")}
+    run_cache["entries"] = cache_stats["entries"]
+    run_info = {"algorithm": final_alg, "strategy": config["strategy"],
+                "converged": search_info["stop_reason"] == "converged", "stop_reason": search_info["stop_reason"],
+                "iterations": search_info["iterations"], "evaluations": evaluator.num_evals,
+                "search_seconds": round(evaluator.elapsed(), 3), "best_reward": round(engine.reward(evaluation), 4),
+                "n_workers": evaluator.n_workers, "batch_size": search_info.get("batch_size"),
+                "reward_mode": engine.reward_mode["mode"], "seed": engine.seed,
+                "fidelity": evaluator.fidelity_stats() if evaluator.multifidelity() else None,
+                "distance_engine": engine.dist_engine.stats() if engine.dist_engine is not None else None,
+                "neighbour_graphs": engine.neighbour_graphs.stats(),
+                "algorithm_costs": evaluator.algorithm_costs(),
+                "timeouts": len(evaluator.timed_out), "pool_restarts": evaluator.pool_restarts,
+                "reward_cache": run_cache,
+                # sampled during the search (None without psutil) and reported by the workers (None without a pool)
+                "peak_rss_mb": {"process": rss.peak_mb(),
+                                "workers": None if evaluator.worker_peak_mb is None else round(evaluator.worker_peak_mb, 1)}}
+    print("Reward cache:", run_info["reward_cache"])
+    print("Peak RSS (MB):", run_info["peak_rss_mb"])
+
+    return anomalies, cluster_sizes, final_feats, run_info
  
 
 ##### MAIN #####
 '''
-
+Runs the feature/algorithm search on the uploaded data (backend_data["df"] and its
+backend_data["features"]) with the RL_CONFIG settings overridden by options, in an
+RLEngine of its own. Returns the anomalies, the cluster sizes, the final features and
+the run statistics.
 '''
-def run_rl(backend_data):
-    features = backend_data["features"]
-    print("Selected features:", features)
-    # raise Exception
-    global FEATURES, ALGORITHMS, NUM_ALG, OG_FEATURES
-    FEATURES = {k:str(v) for k,v in zip(range(len(features)), features) }
-    data = backend_data["df"]
-    ALGORITHMS = {0: 'DBSCAN Clustering', 1: 'Mean Shift', 2: 'K-Mediods', 3: 'EM Clustering', 4: 'K-Means'}
-    NUM_ALG = len(ALGORITHMS)
-    OG_FEATURES = data[features].copy(deep = True)
-    # print(OG_FEATURES.head(10))
-
-    scaler = StandardScaler()
-    original_features_scaled = scaler.fit_transform(OG_FEATURES)
-    # if backend_data["uid"] == None:
-    #     data['uid'] = data.index # comment out because done in feature selection
-    #     backend_data["uid"] = "uid"
-    event_ids = data[backend_data["uid"]]
-
-    anomalies, cluster_sizes, final_features = RL(data, original_features_scaled)
-    return anomalies, cluster_sizes, final_features
-
-
+def run_rl(backend_data, options=None):
+    return RLEngine(backend_data, options).run()
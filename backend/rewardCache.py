@@ -0,0 +1,149 @@
+# Memoization layer for the reward evaluations done in reinforcementLearning.RL.
+# An entry stores the silhouette scores, (compact) cluster labels and measured cost
+# (seconds, memory) of one (dataset, feature mask, algorithm, algorithm params)
+# evaluation so that repeated
+# pairs, reruns and re-uploads of an identical dataset skip the clustering entirely.
+
+import os
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+
+
+'''Returns a hex digest identifying the column names and values of df.'''
+def dataset_fingerprint(df):
+    digest = hashlib.sha1()
+    digest.update("|".join(str(c) for c in df.columns).encode())
+    digest.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+'''Returns labels as the smallest signed integer numpy array that can hold them.'''
+def compact_labels(labels):
+    labels = np.asarray(labels)
+    if labels.size == 0:
+        return labels.astype(np.int8)
+    lo, hi = labels.min(), labels.max()
+    for dtype in (np.int8, np.int16, np.int32):
+        info = np.iinfo(dtype)
+        if lo >= info.min and hi <= info.max:
+            return labels.astype(dtype, copy=False)
+    return labels.astype(np.int64, copy=False)
+
+
+class RewardCache:
+    """
+    LRU cache of reward evaluations with an optional on-disk store. Safe to share
+    between the threads of concurrent runs.
+
+    Parameters:
+        max_entries: int, number of entries kept in memory before the least
+            recently used one is evicted
+        max_bytes: int, bound on the memory used by the labels of the in-memory
+            entries (least recently used entries are evicted first)
+        disk_dir: str or None, directory where every entry is also written so
+            it survives evictions and server restarts
+    """
+
+    def __init__(self, max_entries=4096, max_bytes=256 * 2**20, disk_dir=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.disk_dir = disk_dir
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.lock = threading.RLock()
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(fingerprint, state, action, params):
+        params = ",".join(f"{k}={params[k]!r}" for k in sorted(params))
+        return hashlib.sha1(f"{fingerprint}:{state}:{action}:{params}".encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.disk_dir, key + ".npz")
+
+    def get(self, key):
+        """Returns the cached entry for key, or None on a miss."""
+        with self.lock:
+            return self._get(key)
+
+    def _get(self, key):
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry
+        if self.disk_dir and os.path.exists(self._path(key)):
+            with np.load(self._path(key), allow_pickle=False) as stored:
+                # entries written before costs were stored have none
+                costs = stored["costs"] if "costs" in stored.files else np.array([np.nan, np.nan])
+                entry = {"selected": float(stored["scores"][0]),
+                         "overall": float(stored["scores"][1]),
+                         "labels": stored["labels"],
+                         "seconds": None if np.isnan(costs[0]) else float(costs[0]),
+                         "memory_mb": None if np.isnan(costs[1]) else float(costs[1])}
+            self._remember(key, entry)
+            self.disk_hits += 1
+            return entry
+        self.misses += 1
+        return None
+
+    def put(self, key, selected, overall, labels, seconds=None, memory_mb=None):
+        """
+        Stores the scores, labels and cost (seconds and peak MB of the clustering, None
+        if not measured) of one evaluation and returns the entry.
+        """
+        entry = {"selected": float(selected), "overall": float(overall), "labels": compact_labels(labels),
+                 "seconds": None if seconds is None else float(seconds),
+                 "memory_mb": None if memory_mb is None else float(memory_mb)}
+        with self.lock:
+            self._remember(key, entry)
+        if self.disk_dir:
+            # write to a temporary file of this writer first so readers never see a partial entry
+            # (other threads or processes may write the same key at the same time)
+            fd, tmp_path = tempfile.mkstemp(suffix=".tmp.npz", dir=self.disk_dir)
+            costs = np.array([np.nan if entry[k] is None else entry[k] for k in ("seconds", "memory_mb")])
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    np.savez(f, scores=np.array([entry["selected"], entry["overall"]]), labels=entry["labels"], costs=costs)
+                os.replace(tmp_path, self._path(key))
+            except BaseException:
+                os.remove(tmp_path)
+                raise
+        return entry
+
+    def _remember(self, key, entry):
+        old = self.entries.pop(key, None)
+        if old is not None:
+            self.nbytes -= old["labels"].nbytes
+        self.entries[key] = entry
+        self.nbytes += entry["labels"].nbytes
+        while len(self.entries) > 1 and (len(self.entries) > self.max_entries or self.nbytes > self.max_bytes):
+            _, evicted = self.entries.popitem(last=False)
+            self.nbytes -= evicted["labels"].nbytes
+
+    def stats(self):
+        """Returns the hit/miss counters of the cache."""
+        with self.lock:
+            return self._stats()
+
+    def _stats(self):
+        lookups = self.hits + self.disk_hits + self.misses
+        return {"hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+                "entries": len(self.entries),
+                "label_mb": self.nbytes / 2**20}
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.nbytes = 0
+            self.hits = self.disk_hits = self.misses = 0
@@ -0,0 +1,176 @@
+# Clustering quality metrics used as the RL reward.
+# "exact" is sklearn's silhouette score, which is O(n^2) in the number of rows.
+# The other modes approximate it for large datasets:
+#   "sampled"    - exact silhouette on a fixed-size sample stratified by cluster
+#   "simplified" - centroid-based (simplified) silhouette, O(n * k)
+#   "calinski"   - Calinski-Harabasz index, O(n), mapped onto [-1, 1)
+
+import os
+import tempfile
+import numpy as np
+from sklearn.metrics import silhouette_score, calinski_harabasz_score
+from sklearn.metrics.pairwise import euclidean_distances
+
+REWARD_MODES = ("exact", "sampled", "simplified", "calinski")
+
+
+'''
+Returns indexes of a sample of size ~sample_size from labels, drawn from every
+cluster in proportion to its size (at least 2 points per cluster when possible).
+'''
+def stratified_sample(labels, sample_size, rng):
+    clusters, inverse, counts = np.unique(labels, return_inverse=True, return_counts=True)
+    take = np.maximum(np.minimum(counts, 2), np.round(counts * sample_size / len(labels)).astype(int))
+    take = np.minimum(take, counts)
+    order = np.argsort(inverse, kind="stable")
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    idx = [rng.choice(order[start:start + count], size=n, replace=False)
+           for start, count, n in zip(starts, counts, take)]
+    return np.sort(np.concatenate(idx))
+
+'''
+Returns an order of the rows in which every prefix is a sample stratified by strata
+(one stratum per row): the rows of each stratum are shuffled and spread evenly over
+the order, so the first m rows hold about m * share of every stratum.
+'''
+def fidelity_order(strata, rng):
+    _, inverse, counts = np.unique(strata, return_inverse=True, return_counts=True)
+    # random rank of every row within its stratum
+    perm = rng.permutation(len(inverse))
+    grouped = perm[np.argsort(inverse[perm], kind="stable")]
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    rank = np.empty(len(inverse))
+    rank[grouped] = np.arange(len(inverse)) - np.repeat(starts, counts)
+    return np.argsort((rank + rng.random(len(inverse))) / counts[inverse], kind="stable")
+
+'''
+Returns the silhouette score of labels from the pairwise distance matrix distances
+(a numpy array or memmap), matching sklearn's silhouette_score(metric="precomputed").
+Works on chunk_rows rows at a time: the distance sums of every point to every
+cluster are a product with the one-hot label matrix.
+'''
+def silhouette_from_distances(distances, labels, chunk_rows=1024):
+    clusters, inverse = np.unique(labels, return_inverse=True)
+    n, k = len(labels), len(clusters)
+    if not 2 <= k <= n - 1:
+        raise ValueError(f"Number of labels is {k}. Valid values are 2 to n_samples - 1 (inclusive)")
+    counts = np.bincount(inverse, minlength=k)
+    onehot = np.zeros((n, k))
+    onehot[np.arange(n), inverse] = 1
+    s = np.empty(n)
+    for start in range(0, n, chunk_rows):
+        stop = min(start + chunk_rows, n)
+        sums = np.asarray(distances[start:stop], dtype=np.float64) @ onehot
+        rows, own = np.arange(stop - start), inverse[start:stop]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            a = sums[rows, own] / (counts[own] - 1)
+            sums[rows, own] = np.inf
+            b = (sums / counts).min(axis=1)
+            s[start:stop] = np.nan_to_num((b - a) / np.maximum(a, b))
+    return float(s.mean())
+
+'''Returns the centroid-based (simplified) silhouette score of labels on X.'''
+def simplified_silhouette(X, labels):
+    clusters, inverse = np.unique(labels, return_inverse=True)
+    if len(clusters) < 2:
+        raise ValueError("Number of labels is 1. Valid values are 2 to n_samples - 1 (inclusive)")
+    counts = np.bincount(inverse)
+    centroids = np.zeros((len(clusters), X.shape[1]))
+    np.add.at(centroids, inverse, X)
+    centroids /= counts[:, None]
+    # squared distances of every point to every centroid
+    sq = (X ** 2).sum(axis=1)[:, None] - 2 * X @ centroids.T + (centroids ** 2).sum(axis=1)[None, :]
+    dist = np.sqrt(np.maximum(sq, 0))
+    rows = np.arange(len(X))
+    a = dist[rows, inverse]
+    dist[rows, inverse] = np.inf
+    b = dist.min(axis=1)
+    denom = np.maximum(a, b)
+    s = np.divide(b - a, denom, out=np.zeros_like(a), where=denom > 0)
+    s[counts[inverse] == 1] = 0 # same convention as sklearn for singleton clusters
+    return float(s.mean())
+
+'''
+Returns the quality of the clustering labels of X in [-1, 1] using mode (see REWARD_MODES).
+If the pairwise distance matrix of X is given, the silhouette modes use it instead of
+recomputing distances. Like silhouette_score, raises ValueError if labels does not
+have 2 to n_samples - 1 clusters.
+'''
+def cluster_score(X, labels, mode="exact", sample_size=2000, random_state=None, distances=None):
+    X = np.asarray(X, dtype=float)
+    labels = np.asarray(labels)
+    match mode:
+        case "exact":
+            if distances is not None:
+                return silhouette_from_distances(distances, labels)
+            return float(silhouette_score(X, labels))
+        case "sampled":
+            idx = np.arange(len(labels))
+            if len(labels) > sample_size:
+                idx = stratified_sample(labels, sample_size, np.random.default_rng(random_state))
+            if distances is not None:
+                return silhouette_from_distances(distances[np.ix_(idx, idx)], labels[idx])
+            return float(silhouette_score(X[idx], labels[idx]))
+        case "simplified":
+            return simplified_silhouette(X, labels)
+        case "calinski":
+            ch = calinski_harabasz_score(X, labels)
+            return float((ch - 1) / (ch + 1))
+    raise ValueError(f"Unknown reward mode {mode!r}, expected one of {REWARD_MODES}")
+
+
+class FullSilhouette:
+    """
+    Exact silhouette scores of any labeling of a fixed X (the RL's full feature space).
+    The pairwise distances of X are computed once, in row chunks and as float32,
+    and kept in memory, or in a memory-mapped file when they need more than
+    max_memory_bytes (or when the file has to be shared with worker processes).
+
+    Parameters:
+        X: array, shape (n_samples, n_features)
+        max_memory_bytes: int, largest distance matrix kept in RAM
+        mmap_dir: str or None, directory of the memory-mapped file (default: system temp dir)
+        force_mmap: bool, always use a memory-mapped file
+        chunk_rows: int, rows of distances computed/read at a time
+    """
+
+    def __init__(self, X, max_memory_bytes=1024 * 2**20, mmap_dir=None, force_mmap=False, chunk_rows=1024):
+        X = np.asarray(X, dtype=np.float64)
+        n = len(X)
+        self.chunk_rows = chunk_rows
+        self.path = None
+        if force_mmap or n * n * 4 > max_memory_bytes:
+            fd, self.path = tempfile.mkstemp(suffix=".f32", dir=mmap_dir)
+            os.close(fd)
+            self.distances = np.memmap(self.path, dtype=np.float32, mode="w+", shape=(n, n))
+        else:
+            self.distances = np.empty((n, n), dtype=np.float32)
+        for start in range(0, n, chunk_rows):
+            self.distances[start:start + chunk_rows] = euclidean_distances(X[start:start + chunk_rows], X)
+        np.fill_diagonal(self.distances, 0)
+        if self.path is not None:
+            self.distances.flush()
+
+    @classmethod
+    def open(cls, path, n, chunk_rows=1024):
+        """Opens (read-only) the memory-mapped distances written by another FullSilhouette."""
+        self = cls.__new__(cls)
+        self.chunk_rows = chunk_rows
+        self.path = None # owned (and deleted) by the writer
+        self.distances = np.memmap(path, dtype=np.float32, mode="r", shape=(n, n))
+        return self
+
+    @staticmethod
+    def disk_needed(n_rows):
+        return n_rows * n_rows * 4
+
+    def score(self, labels):
+        """Returns the exact silhouette score of labels (raises ValueError like silhouette_score)."""
+        return silhouette_from_distances(self.distances, np.asarray(labels), self.chunk_rows)
+
+    def close(self):
+        """Releases the distances and deletes the memory-mapped file, if any."""
+        self.distances = None
+        if self.path is not None:
+            os.remove(self.path)
+            self.path = None
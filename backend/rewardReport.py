@@ -0,0 +1,63 @@
+# Accuracy-vs-speed report of the approximate reward modes in rewardMetrics against
+# the exact silhouette score, on the Zeek samples bundled under data/.
+# Run from the project root:
+#   python -m backend.rewardReport [sample_size]
+
+import os, sys, time
+import numpy as np
+import pandas as pd
+from scipy.stats import spearmanr
+from sklearn.cluster import KMeans
+from sklearn.preprocessing import StandardScaler
+from backend.rewardMetrics import cluster_score, REWARD_MODES
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+DATASETS = ["capstone-data/sampled_zeek22_100.csv",
+            "capstone-data/sampled_zeek22_500.csv",
+            "capstone-data/sample.csv",
+            "real-world/data-cleaning/cleaned_RW21.csv"]
+
+'''Returns the standardized, non-constant numeric columns of the csv at path.'''
+def load_features(path):
+    df = pd.read_csv(path).dropna(axis=1, how="all").dropna()
+    numeric = df.select_dtypes(include="number")
+    numeric = numeric.loc[:, numeric.nunique() > 1]
+    return StandardScaler().fit_transform(numeric)
+
+'''Returns KMeans labelings of random feature subsets of X, like the ones scored during RL.'''
+def sample_labelings(X, n_labelings=20, seed=0):
+    rng = np.random.default_rng(seed)
+    labelings = []
+    for _ in range(n_labelings):
+        cols = rng.choice(X.shape[1], size=rng.integers(1, min(5, X.shape[1]) + 1), replace=False)
+        k = int(rng.integers(2, 6))
+        labelings.append(KMeans(n_clusters=k, n_init=1, random_state=int(rng.integers(1 << 31))).fit_predict(X[:, cols]))
+    return labelings
+
+'''Returns one report row per reward mode for the dataset at path.'''
+def report_dataset(path, sample_size):
+    X = load_features(path)
+    labelings = sample_labelings(X)
+    scores, seconds = {}, {}
+    for mode in REWARD_MODES:
+        start = time.perf_counter()
+        scores[mode] = np.array([cluster_score(X, labels, mode, sample_size, random_state=0) for labels in labelings])
+        seconds[mode] = time.perf_counter() - start
+    rows = []
+    for mode in REWARD_MODES:
+        rows.append({"dataset": os.path.basename(path),
+                     "rows": X.shape[0],
+                     "mode": mode,
+                     "mean_abs_err": np.abs(scores[mode] - scores["exact"]).mean(),
+                     "spearman": spearmanr(scores[mode], scores["exact"])[0],
+                     "ms_per_score": 1000 * seconds[mode] / len(labelings),
+                     "speedup": seconds["exact"] / seconds[mode]})
+    return rows
+
+if __name__ == "__main__":
+    sample_size = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    rows = []
+    for name in DATASETS:
+        rows += report_dataset(os.path.join(DATA_DIR, name), sample_size)
+    print(f"Reward modes vs exact silhouette (sampled mode: {sample_size} rows)")
+    print(pd.DataFrame(rows).to_string(index=False, float_format=lambda v: f"{v:.3f}"))
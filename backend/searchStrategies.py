@@ -0,0 +1,124 @@
+# Alternative searches over (feature mask, algorithm) pairs for reinforcementLearning.RL.
+# Like the Q-learning they only see the data through an evaluator (see
+# reinforcementLearning.PairEvaluator), so every strategy scores pairs with the same
+# reward and shares the reward cache and the evaluation/time budgets:
+#   evaluator.score(pairs, n_rows=None) - immediate reward of each pair (None if the
+#                                          budget ran out), optionally on the first
+#                                          n_rows rows of the evaluation order only
+#   evaluator.exhausted()               - name of the exhausted budget, or None
+#   evaluator.random                    - random.Random of the run (seeded for reproducible runs)
+# A mask is a feature bitmask (any non-zero int below 2**num_features).
+# Each strategy returns the best (mask, algorithm) pair found and a dict with
+# the number of iterations and the stop reason.
+
+import math
+
+
+'''
+Scores pairs and returns the (score, pair) of the evaluated ones, best first.
+'''
+def ranked(evaluator, pairs, n_rows=None):
+    scores = evaluator.score(pairs, n_rows)
+    scored = [(score, pair) for score, pair in zip(scores, pairs) if score is not None]
+    # ties go to the smaller mask (fewer/earlier features), then to the lower algorithm
+    return sorted(scored, key=lambda sp: (-sp[0], sp[1]))
+
+'''
+Greedy forward selection: starting from no features, repeatedly adds the feature
+(and picks the algorithm) that gives the best reward, and stops when no addition
+improves on the best pair so far.
+'''
+def greedy_forward(evaluator, num_features, num_actions, config):
+    best_score, best_pair = None, None
+    mask, iterations, stop_reason = 0, 0, "converged"
+    while mask != (1 << num_features) - 1:
+        iterations += 1
+        candidates = [(mask | (1 << f), a) for f in range(num_features) if not mask >> f & 1
+                      for a in range(num_actions)]
+        results = ranked(evaluator, candidates)
+        if results and (best_score is None or results[0][0] > best_score):
+            best_score, best_pair = results[0]
+            mask = best_pair[0]
+        elif results:
+            break
+        if evaluator.exhausted():
+            stop_reason = evaluator.exhausted()
+            break
+    else:
+        stop_reason = "all_features"
+    return best_pair, {"iterations": iterations, "stop_reason": stop_reason}
+
+'''
+Beam search: keeps the beam_width masks with the best reward (over all algorithms)
+at each size, expands each of them by one feature and stops when a level does not
+improve on the best pair so far.
+'''
+def beam_search(evaluator, num_features, num_actions, config):
+    width = max(1, config["beam_width"])
+    best_score, best_pair = None, None
+    beam, iterations, stop_reason = [0], 0, "all_features"
+    while beam:
+        iterations += 1
+        masks = sorted({m | (1 << f) for m in beam for f in range(num_features) if not m >> f & 1})
+        if not masks:
+            break
+        results = ranked(evaluator, [(m, a) for m in masks for a in range(num_actions)])
+        # a mask is as good as its best algorithm
+        beam = []
+        for _, (m, _) in results:
+            if m not in beam:
+                beam.append(m)
+            if len(beam) == width:
+                break
+        if results and (best_score is None or results[0][0] > best_score):
+            best_score, best_pair = results[0]
+        elif results:
+            stop_reason = "converged"
+            break
+        if evaluator.exhausted():
+            stop_reason = evaluator.exhausted()
+            break
+    return best_pair, {"iterations": iterations, "stop_reason": stop_reason}
+
+'''
+Successive halving: scores halving_candidates random pairs on a small sample of
+the rows, keeps the best 1 / halving_eta of them and rescores the survivors on
+halving_eta times more rows, until the last round runs on all the rows.
+'''
+def successive_halving(evaluator, num_features, num_actions, config):
+    eta = max(2, config["halving_eta"])
+    total = ((1 << num_features) - 1) * num_actions
+    if total <= config["halving_candidates"]:
+        candidates = [(m, a) for m in range(1, 1 << num_features) for a in range(num_actions)]
+    else:
+        candidates = set()
+        while len(candidates) < config["halving_candidates"]:
+            candidates.add((evaluator.random.randrange(1, 1 << num_features), evaluator.random.randrange(num_actions)))
+        candidates = sorted(candidates)
+
+    # rows of every round: n_rows / eta ** (rounds left), at least halving_min_rows
+    n_rows = evaluator.n_rows
+    rounds = max(0, math.ceil(math.log(len(candidates), eta)))
+    best_pair, stop_reason = None, "converged"
+    for r in range(rounds + 1):
+        rows = max(config["halving_min_rows"], n_rows // eta ** (rounds - r))
+        last = r == rounds or rows >= n_rows
+        results = ranked(evaluator, candidates, None if last else rows)
+        if not results:
+            stop_reason = evaluator.exhausted()
+            break
+        if last:
+            best_pair = results[0][1]
+            break
+        candidates = [pair for _, pair in results[:math.ceil(len(candidates) / eta)]]
+        best_pair = candidates[0]
+        if evaluator.exhausted():
+            stop_reason = evaluator.exhausted()
+            break
+    return best_pair, {"iterations": r + 1, "stop_reason": stop_reason}
+
+
+# config["strategy"] values other than the default "qlearning"
+SEARCH_STRATEGIES = {"greedy": greedy_forward,
+                     "beam": beam_search,
+                     "halving": successive_halving}
@@ -0,0 +1,45 @@
+# Benchmark of the search strategies (Q-learning and searchStrategies) on the Zeek
+# samples bundled under data/: evaluations, search time and reward of the chosen
+# configuration, each strategy starting from an empty reward cache.
+# Run from the project root:
+#   python -m backend.strategyReport [num_feat] [repeats]
+
+import os, sys
+import pandas as pd
+from backend.backendInterface import add_data, find_anomalies, backend_data
+from backend.reinforcementLearning import REWARD_CACHE
+from backend.searchStrategies import SEARCH_STRATEGIES
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+DATASETS = ["capstone-data/sampled_zeek22_100.csv",
+            "capstone-data/sampled_zeek22_500.csv"]
+STRATEGIES = ["qlearning", *SEARCH_STRATEGIES]
+
+'''Returns one report row per strategy and repeat for the dataset at path.'''
+def report_dataset(path, num_feat, repeats):
+    rows = []
+    for strategy in STRATEGIES:
+        for repeat in range(repeats):
+            REWARD_CACHE.clear()
+            add_data(path)
+            find_anomalies(query={"start": None, "strategy": strategy}, uid="uid", num_feat=num_feat,
+                           time="datetime", source_ip="src_ip_zeek")
+            run_info = backend_data["run_info"]
+            rows.append({"dataset": os.path.basename(path),
+                         "strategy": strategy,
+                         "repeat": repeat,
+                         "evaluations": run_info["evaluations"],
+                         "seconds": run_info["search_seconds"],
+                         "best_reward": run_info["best_reward"],
+                         "algorithm": run_info["algorithm"],
+                         "features": ",".join(backend_data["final_features"])})
+    return rows
+
+if __name__ == "__main__":
+    num_feat = int(sys.argv[1]) if len(sys.argv) > 1 else 6
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+    rows = []
+    for name in DATASETS:
+        rows += report_dataset(os.path.join(DATA_DIR, name), num_feat, repeats)
+    print(f"Search strategies on {num_feat} candidate features")
+    print(pd.DataFrame(rows).to_string(index=False, float_format=lambda v: f"{v:.3f}"))
@@ -0,0 +1,183 @@
+# Reader of raw Zeek logs (e.g. conn.log), so captures can be uploaded without first
+# converting them to CSV. Both of Zeek's writers are read in chunks for dataIngest:
+# TSV logs with pyarrow's CSV parser, typed from the #fields/#types header, and JSON
+# logs (one object per line) with pandas' chunked JSON reader. Several files (the
+# rotations of one capture, possibly gzipped) are read as one table.
+
+import gzip
+import numpy as np
+import pandas as pd
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+except ImportError: # JSON logs can still be read, TSV logs are refused
+    pa = None
+
+ZEEK_FORMATS = (".log", ".json")
+# column added from ts, as in the converted captures (sampled_zeek22_*.csv)
+DATETIME_COLUMN = "datetime"
+# rows per chunk of a JSON log (conn.log entries are ~400 bytes)
+JSON_ROW_BYTES = 400
+# Zeek types read as floats and integers; unset values of the other types stay text
+FLOAT_TYPES = ("time", "interval", "double")
+INT_TYPES = ("count", "int", "port")
+
+
+'''Returns the header of a TSV log (#separator, #fields, #types, ...) as a dict of strings.'''
+def parse_header(lines):
+    header = {"separator": "\t", "set_separator": ",", "empty_field": "(empty)", "unset_field": "-"}
+    for line in lines:
+        if line.startswith("#separator"):
+            # the only header line written with a space, e.g. "#separator \x09"
+            header["separator"] = line.split(" ", 1)[1].encode().decode("unicode_escape")
+            continue
+        key, _, value = line[1:].partition(header["separator"])
+        header[key] = value
+    return header
+
+'''
+Opens source (a path or binary file object) for reading bytes, decompressing it when
+its name ends in .gz.
+'''
+def open_log(source, name):
+    gzipped = str(name if name is not None else source).lower().endswith(".gz")
+    if hasattr(source, "read"):
+        return gzip.GzipFile(fileobj=source) if gzipped else source
+    return gzip.open(source, "rb") if gzipped else open(source, "rb")
+
+'''
+Reads the leading #-lines of the open log f and returns them, leaving f at the first
+data row. Returns None if the log is JSON (its first character is "{").
+'''
+def read_header_lines(f):
+    lines = []
+    while True:
+        position = f.tell()
+        line = f.readline()
+        if not lines and line.lstrip().startswith(b"{"):
+            f.seek(position)
+            return None
+        if not line.startswith(b"#"):
+            f.seek(position)
+            return lines
+        lines.append(line.decode("utf-8").rstrip("\r\n"))
+
+'''
+Returns the chunk with Zeek's unset values filled so that cleaning keeps the row:
+counters and intervals count as 0 (Zeek leaves them unset when nothing was measured),
+booleans as False and text as the unset marker. Unset times stay missing.
+'''
+def fill_unset(chunk, types, unset="-"):
+    for name, kind in types.items():
+        col = chunk[name]
+        if kind in INT_TYPES:
+            chunk[name] = col.fillna(0).astype(np.int64)
+        elif kind in FLOAT_TYPES and kind != "time":
+            chunk[name] = col.fillna(0.0).astype(np.float64)
+        elif kind == "bool":
+            chunk[name] = col.fillna(False).astype(bool)
+        elif kind == "addr":
+            # addresses repeat a lot, so they are kept as categoricals of their text
+            chunk[name] = col.fillna(unset).astype("category")
+        elif kind != "time":
+            chunk[name] = col.fillna(unset)
+    return chunk
+
+'''Adds DATETIME_COLUMN (naive UTC) from the epoch seconds of ts, unless the log has one.'''
+def add_datetime(chunk):
+    if "ts" in chunk and DATETIME_COLUMN not in chunk:
+        chunk[DATETIME_COLUMN] = pd.to_datetime(chunk["ts"], unit="s")
+    return chunk
+
+'''Yields the typed pandas chunks of the TSV log open in f, with the given header.'''
+def tsv_chunks(f, header, chunk_bytes):
+    if pa is None:
+        raise ValueError("Zeek TSV logs need pyarrow (pip install pyarrow)")
+    fields = header["fields"].split(header["separator"])
+    types = dict(zip(fields, header["types"].split(header["separator"])))
+    column_types = {}
+    for name, kind in types.items():
+        if kind in FLOAT_TYPES:
+            column_types[name] = pa.float64()
+        elif kind in INT_TYPES:
+            column_types[name] = pa.int64()
+        elif kind == "bool":
+            column_types[name] = pa.bool_()
+        else: # addr, string, enum, sets and vectors are kept as text
+            column_types[name] = pa.string()
+    read_options = pa_csv.ReadOptions(column_names=fields, block_size=chunk_bytes)
+    # Zeek does not quote; the #close line (and the headers of logs appended to this
+    # one) have another number of fields and are skipped
+    parse_options = pa_csv.ParseOptions(delimiter=header["separator"], quote_char=False,
+                                        invalid_row_handler=lambda row: "skip" if row.text.startswith("#") else "error")
+    convert_options = pa_csv.ConvertOptions(column_types=column_types, null_values=[header["unset_field"]],
+                                            strings_can_be_null=False, true_values=["T"], false_values=["F"])
+    for batch in pa_csv.open_csv(f, read_options=read_options, parse_options=parse_options,
+                                 convert_options=convert_options):
+        yield add_datetime(fill_unset(batch.to_pandas(), types, header["unset_field"]))
+
+'''Returns the Zeek type of the JSON column col: its times are epoch numbers or ISO strings.'''
+def json_type(name, col):
+    if name == "ts":
+        return "time"
+    if pd.api.types.is_bool_dtype(col):
+        return "bool"
+    if pd.api.types.is_integer_dtype(col):
+        return "count"
+    if pd.api.types.is_float_dtype(col):
+        return "double"
+    return "string"
+
+'''Yields the typed pandas chunks of the JSON log open in f.'''
+def json_chunks(f, chunk_bytes, set_separator=","):
+    for chunk in pd.read_json(f, lines=True, chunksize=max(1000, chunk_bytes // JSON_ROW_BYTES),
+                              convert_dates=False, dtype=True, precise_float=True):
+        types = {name: json_type(name, col) for name, col in chunk.items()}
+        for name, col in chunk.items():
+            if types[name] == "string":
+                # sets and vectors are JSON arrays; write them like the TSV writer
+                chunk[name] = col.map(lambda v: (set_separator.join(map(str, v)) or "(empty)")
+                                      if isinstance(v, list) else v)
+        if "ts" in chunk and not pd.api.types.is_numeric_dtype(chunk["ts"]):
+            # ISO 8601 timestamps (LogAscii::json_timestamps)
+            ts = pd.to_datetime(chunk["ts"], utc=True, format="ISO8601")
+            chunk["ts"] = (ts - pd.Timestamp(0, tz="UTC")) / pd.Timedelta(seconds=1)
+        elif "ts" in chunk:
+            chunk["ts"] = chunk["ts"].astype(np.float64)
+        yield add_datetime(fill_unset(chunk, types))
+
+'''
+Yields the typed pandas chunks of the Zeek logs at sources (paths or binary file
+objects, TSV or JSON, optionally gzipped; names gives their file names when sources
+are file objects), all with the columns of the first chunk: columns a later file or
+chunk lacks are filled like unset values and its extra columns are dropped.
+'''
+def zeek_chunks(sources, names=None, chunk_bytes=16 * 2**20):
+    names = names if names is not None else [None] * len(sources)
+    columns, fills = None, None
+    for source, name in zip(sources, names):
+        f = open_log(source, name)
+        try:
+            lines = read_header_lines(f)
+            if lines is None:
+                chunks = json_chunks(f, chunk_bytes)
+            else:
+                header = parse_header(lines)
+                if "fields" not in header or "types" not in header:
+                    raise ValueError(f"{name or source} is not a Zeek log (no #fields/#types header)")
+                chunks = tsv_chunks(f, header, chunk_bytes)
+            for chunk in chunks:
+                if columns is None:
+                    columns = list(chunk.columns)
+                    fills = {column: (False if pd.api.types.is_bool_dtype(col)
+                                      else 0 if pd.api.types.is_numeric_dtype(col) else "-")
+                             for column, col in chunk.items() if column not in ("ts", DATETIME_COLUMN)}
+                elif list(chunk.columns) != columns:
+                    chunk = chunk.reindex(columns=columns)
+                    for column, value in fills.items():
+                        if chunk[column].isna().all():
+                            chunk[column] = value
+                yield chunk
+        finally:
+            if f is not source:
+                f.close()
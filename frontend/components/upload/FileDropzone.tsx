@@ -34,7 +34,7 @@ export default function FileDropzone({ onFile }: { onFile: (f: File | null) => v
       <input
         ref={inputRef}
         type="file"
-        accept=".csv,.zip,text/csv,application/zip"
+        accept=".csv,.parquet,.log,.json,.gz,.zip,text/csv,application/zip"
         className="hidden"
         onChange={() => setFile(inputRef.current?.files?.[0] ?? null)}
       />
@@ -47,7 +47,7 @@ export default function FileDropzone({ onFile }: { onFile: (f: File | null) => v
       <div className="text-sm text-zinc-700">
         Drag and drop your file here,<br /> or click to browse
       </div>
-      <div className="mt-1 text-xs text-gray-400">Only one CSV file or ZIP file supported</div>
+      <div className="mt-1 text-xs text-gray-400">One CSV, Parquet or Zeek log file</div>
 
       {/* Small “Browse Files” chip like the comp */}
       <button
@@ -3,8 +3,78 @@
 import { useState } from "react";
 import { useRouter } from "next/navigation";   
 import FileDropzone from "./FileDropzone";
+import { sha256File } from "./sha256";
 
 type UploadResponse = { ok: boolean; status?: string; rows?: number; columns?: number; message?: string };
+type UploadSession = { done: boolean; upload_id?: string; received?: number; chunk_size?: number; rows?: number; columns?: number; reused?: boolean; detail?: string };
+
+const API_BASE = process.env.NEXT_PUBLIC_API_BASE_URL ?? "http://localhost:8000";
+// retries of a failed chunk before giving up (each resumes from the last byte the backend has)
+const MAX_RETRIES = 5;
+
+// bytes read at a time while hashing the file
+const HASH_SLICE_BYTES = 8 * 1024 * 1024;
+
+// Sends the file to the backend's resumable upload API (backend/api/upload.py) in chunks,
+// so neither the browser nor a proxy holds the whole capture in memory. The file is hashed
+// first: the backend skips the upload of a file it already has, and an unfinished upload
+// (its id is kept in localStorage under the hash) is resumed only for the same file.
+async function uploadInChunks(
+  file: File,
+  headers: Record<string, string>,
+  onHashProgress: (fraction: number) => void,
+  onProgress: (fraction: number) => void
+): Promise<UploadResponse> {
+  const sha256 = await sha256File(file, HASH_SLICE_BYTES, onHashProgress);
+  const storageKey = `adas-upload-${sha256}`;
+  const init = await fetch(`${API_BASE}/api/upload/init`, {
+    method: "POST",
+    headers: { "Content-Type": "application/json" },
+    body: JSON.stringify({
+      filename: file.name,
+      size: file.size,
+      sha256,
+      upload_id: localStorage.getItem(storageKey),
+      ...headers,
+    }),
+  });
+  let session = (await init.json()) as UploadSession;
+  if (!init.ok) return { ok: false, message: session.detail ?? "Upload failed." };
+  if (session.done) return { ok: true, status: "success", rows: session.rows, columns: session.columns };
+
+  const id = session.upload_id!;
+  localStorage.setItem(storageKey, id);
+  let offset = session.received ?? 0;
+  let retries = 0;
+  while (!session.done && offset < file.size) {
+    onProgress(offset / file.size);
+    try {
+      const r = await fetch(`${API_BASE}/api/upload/${id}?offset=${offset}`, {
+        method: "PUT",
+        body: file.slice(offset, offset + (session.chunk_size ?? 8 * 1024 * 1024)),
+      });
+      session = (await r.json()) as UploadSession;
+      if (!r.ok && r.status !== 409) throw new Error(session.detail);
+      if (r.status === 409) session = (await (await fetch(`${API_BASE}/api/upload/${id}`)).json()) as UploadSession;
+      offset = session.received ?? offset;
+      retries = 0;
+    } catch (err) {
+      if (++retries > MAX_RETRIES) return { ok: false, message: "Upload interrupted. Submit again to resume." };
+      // resume from what the backend received
+      const status = await fetch(`${API_BASE}/api/upload/${id}`).then((r) => r.json()).catch(() => null);
+      if (status?.received !== undefined) offset = status.received;
+    }
+  }
+  if (!session.done) {
+    const r = await fetch(`${API_BASE}/api/upload/${id}/complete`, { method: "POST" });
+    session = (await r.json()) as UploadSession;
+    // finished, or discarded by the backend (a 409 means bytes are missing, resume later)
+    if (r.status !== 409) localStorage.removeItem(storageKey);
+    if (!r.ok) return { ok: false, message: session.detail ?? "Upload failed." };
+  }
+  onProgress(1);
+  return { ok: true, status: "success", rows: session.rows, columns: session.columns };
+}
 
 export default function UploadCard() {
   const router = useRouter();                   
@@ -22,14 +92,12 @@ export default function UploadCard() {
     if (!sceIPHeader.trim()) return setServerMsg("Please provide the Source IP header (required).");
     setLoading(true);
     try {
-      const fd = new FormData();
-      fd.append("file", file);
-      fd.append("uidHeader", uidHeader);
-      fd.append("tsHeader", tsHeader);
-      fd.append("sceIPHeader", sceIPHeader);
-
-      const r = await fetch("/api/upload", { method: "POST", body: fd });
-      const data = (await r.json()) as UploadResponse;
+      const data = await uploadInChunks(
+        file,
+        { uidHeader, tsHeader, sceIPHeader },
+        (fraction) => setServerMsg(`Checking file… ${Math.round(fraction * 100)}%`),
+        (fraction) => setServerMsg(`Uploading… ${Math.round(fraction * 100)}%`)
+      );
       setServerMsg(
         data.ok ? `✅ Uploaded. Rows: ${data.rows ?? "?"}, Cols: ${data.columns ?? "?"}` : `❌ ${data.message}`
       );